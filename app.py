@@ -7,6 +7,8 @@ from apps.extensions import db, login, mail, babel, moment
 from apps.admin.errors import register_error_handlers
 from apps.admin.logging import setup_logging
 from apps.cli import register_cli_commands
+from apps.events import register_event_handlers
+from apps.search_client import create_client
 import redis
 import rq
 from apps.api import bp as api_bp
@@ -29,13 +31,8 @@ def create_app(config_class=Config):
     # Register API blueprint
     app.register_blueprint(api_bp, url_prefix='/api')
 
-    # Elasticsearch - Optional import
-    if app.config.get('ELASTICSEARCH_URL'):
-        try:
-            from elasticsearch import Elasticsearch
-            app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']])
-        except ImportError:
-            pass
+    # Elasticsearch - optional, behind timeouts and a circuit breaker
+    app.elasticsearch = create_client(app)
 
     # Configure login manager
     login.login_view = 'user.login'
@@ -69,10 +66,8 @@ def create_app(config_class=Config):
     register_error_handlers(app)
     register_cli_commands(app)
 
-    # Search event handlers
-    from apps.search import SearchableMixin
-    db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
-    db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+    # Model and session event handlers
+    register_event_handlers()
 
     @app.shell_context_processor
     def make_shell_context():
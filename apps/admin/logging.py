@@ -3,7 +3,7 @@ from logging.handlers import SMTPHandler, RotatingFileHandler
 import os
 
 def setup_logging(app):
-    if not app.debug:
+    if not app.debug and not app.testing:
         if not os.path.exists('logs'):
             os.mkdir('logs')
 
@@ -1,5 +1,7 @@
 from datetime import datetime
+from flask import current_app
 from apps.extensions import db
+from apps import cache
 from apps.search import SearchableMixin
 
 class Post(SearchableMixin, db.Model):
@@ -7,10 +9,41 @@ class Post(SearchableMixin, db.Model):
     __searchable__ = ['body']
     
     id = db.Column(db.Integer, primary_key=True)
-    body = db.Column(db.String(140))
+    # Edits load the old body so the type-ahead index can uncount its words
+    body = db.column_property(db.Column(db.String(140)), active_history=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     language = db.Column(db.String(5))
 
+    @staticmethod
+    def after_insert(mapper, connection, post):
+        # Count the post and fan it out to the author's and followers' timelines
+        from apps.user.models import User, followers, timeline
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == post.user_id).values(
+            post_count=users.c.post_count + 1))
+        cache.invalidate_on_commit('user', str(post.user_id))
+        connection.execute(timeline.insert().values(
+            user_id=post.user_id, post_id=post.id, timestamp=post.timestamp))
+        follower_count = connection.scalar(
+            db.select(users.c.follower_count).where(users.c.id == post.user_id))
+        if (follower_count or 0) <= current_app.config['TIMELINE_FANOUT_LIMIT']:
+            readers = db.select(
+                followers.c.follower_id,
+                db.literal(post.id),
+                db.literal(post.timestamp, db.DateTime)
+            ).where(followers.c.followed_id == post.user_id)
+            connection.execute(timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'], readers))
+
+    @staticmethod
+    def before_delete(mapper, connection, post):
+        from apps.user.models import User, timeline
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == post.user_id).values(
+            post_count=users.c.post_count - 1))
+        cache.invalidate_on_commit('user', str(post.user_id))
+        connection.execute(timeline.delete().where(timeline.c.post_id == post.id))
+
     def __repr__(self):
-        return f"<Post {self.body}>"
\ No newline at end of file
+        return f"<Post {self.body}>"
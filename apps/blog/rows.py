@@ -0,0 +1,39 @@
+"""Read-only rows for post listings.
+
+A listing needs a handful of post columns plus the author's name and avatar,
+so it selects just those with one join instead of loading Post and User
+objects one author at a time. The rows are plain tuples that blog/_post.html
+renders the same way as the models.
+"""
+from collections import namedtuple
+from apps.extensions import db
+from apps.blog.models import Post
+from apps.user.models import User, avatar_url
+
+class Author(namedtuple('Author', 'id username avatar_hash')):
+    __slots__ = ()
+
+    def avatar(self, size):
+        return avatar_url(self.avatar_hash, size)
+
+class PostRow(namedtuple('PostRow', 'id body timestamp language author')):
+    __slots__ = ()
+
+COLUMNS = (Post.id, Post.body, Post.timestamp, Post.language,
+           Post.user_id, User.username, User.avatar_hash)
+
+def project(query):
+    """Turn a query for Post into one for the columns of a listing."""
+    return query.join(User, User.id == Post.user_id).with_entities(*COLUMNS)
+
+def load(results):
+    return [PostRow(id, body, timestamp, language, Author(user_id, username, avatar_hash))
+            for id, body, timestamp, language, user_id, username, avatar_hash in results]
+
+def by_id(ids):
+    """The rows of these posts, in the order of ids."""
+    if not ids:
+        return []
+    found = {row.id: row for row in load(db.session.execute(
+        db.select(*COLUMNS).join(User, User.id == Post.user_id).where(Post.id.in_(ids))))}
+    return [found[id] for id in ids if id in found]
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import redis
+from flask import current_app
+from apps.extensions import db
+
+INVALIDATION_CHANNEL = 'cache-invalidate'
+
+class LocalCache(object):
+    """Per-process LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_caches = {}
+_listener_pid = None
+
+def local_cache(name):
+    if name not in _caches:
+        _caches[name] = LocalCache(
+            maxsize=current_app.config['LOCAL_CACHE_SIZE'],
+            ttl=current_app.config['LOCAL_CACHE_TTL'])
+    return _caches[name]
+
+def _listen(app):
+    # Evict entries other processes invalidated; anything may have been
+    # missed while disconnected, so start from empty caches on (re)connect
+    delay = 1
+    while True:
+        try:
+            pubsub = app.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for cache in _caches.values():
+                cache.clear()
+            delay = 1
+            for message in pubsub.listen():
+                name, keys = json.loads(message['data'])
+                if name in _caches:
+                    for key in keys:
+                        _caches[name].delete(key)
+        except (redis.exceptions.RedisError, ValueError):
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+def _ensure_listener():
+    # One listener thread per process, started lazily so it survives forks
+    global _listener_pid
+    if _listener_pid != os.getpid():
+        _listener_pid = os.getpid()
+        threading.Thread(target=_listen, args=(current_app._get_current_object(),),
+                         daemon=True).start()
+
+def get(name, key):
+    """Read through the local cache, then Redis. Returns None on a miss."""
+    _ensure_listener()
+    cache = local_cache(name)
+    value = cache.get(key)
+    if value is not None:
+        return value
+    try:
+        data = current_app.redis.get(f'{name}:{key}')
+    except redis.exceptions.RedisError:
+        return None
+    if data is None:
+        return None
+    value = json.loads(data)
+    cache.set(key, value)
+    return value
+
+def get_many(name, keys):
+    """{key: value} of the keys found, with one MGET for local misses."""
+    _ensure_listener()
+    cache = local_cache(name)
+    found = {}
+    missing = []
+    for key in keys:
+        value = cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    if not missing:
+        return found
+    try:
+        values = current_app.redis.mget([f'{name}:{key}' for key in missing])
+    except redis.exceptions.RedisError:
+        return found
+    for key, data in zip(missing, values):
+        if data is not None:
+            found[key] = json.loads(data)
+            cache.set(key, found[key])
+    return found
+
+def set_many(name, values, ttl):
+    cache = local_cache(name)
+    for key, value in values.items():
+        cache.set(key, value, ttl)
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(f'{name}:{key}', json.dumps(value), ex=max(int(ttl), 1))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+def set(name, key, value, ttl):
+    local_cache(name).set(key, value, ttl)
+    try:
+        current_app.redis.set(f'{name}:{key}', json.dumps(value), ex=max(int(ttl), 1))
+    except redis.exceptions.RedisError:
+        pass
+
+def invalidate(name, *keys):
+    """Drop keys from Redis and from the local caches of every process."""
+    for key in keys:
+        local_cache(name).delete(key)
+    try:
+        pipe = current_app.redis.pipeline()
+        pipe.delete(*[f'{name}:{key}' for key in keys])
+        pipe.publish(INVALIDATION_CHANNEL, json.dumps([name, list(keys)]))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+def invalidate_on_commit(name, *keys):
+    # Invalidating before the commit would let a concurrent reader cache the
+    # old row again, so the keys are dropped from the after_commit hook
+    db.session.info.setdefault('cache_invalidate', []).append((name, keys))
+
+def after_commit(session):
+    for name, keys in session.info.pop('cache_invalidate', []):
+        invalidate(name, *keys)
+
+def after_rollback(session):
+    session.info.pop('cache_invalidate', None)
@@ -1,4 +1,5 @@
 import os
+import time
 import click
 from flask import current_app
 
@@ -70,11 +71,115 @@ def register_cli_commands(app):
             print('Elasticsearch not configured - skipping search reindex.')
 
     @app.cli.command()
-    def init_elasticsearch():
+    @click.option('--workers', default=None, type=int,
+                  help='Number of indexing processes.')
+    @click.option('--resume', is_flag=True,
+                  help='Continue an interrupted run instead of starting over.')
+    def init_elasticsearch(workers, resume):
         """Initialize Elasticsearch indices."""
         if not current_app.elasticsearch:
             print('Elasticsearch is not configured.')
             return
         from apps.blog.models import Post
-        Post.reindex()
-        print('Elasticsearch indices initialized.')
\ No newline at end of file
+        count = Post.reindex(workers=workers, resume=resume,
+                             progress=lambda done, total: print(f'{done}/{total} ranges indexed'))
+        print(f'Elasticsearch indices initialized with {count} posts.')
+
+    @app.cli.group()
+    def timeline():
+        """Home timeline commands."""
+        pass
+
+    @timeline.command()
+    @click.option('--username', default=None,
+                  help='Only rebuild the timeline of this user.')
+    def rebuild(username):
+        """Rebuild materialized home timelines from scratch."""
+        from apps.extensions import db
+        from apps.user.models import User
+        query = User.query.order_by(User.id)
+        if username:
+            query = query.filter_by(username=username)
+        count = 0
+        for user in query.all():
+            user.rebuild_timeline()
+            db.session.commit()
+            count += 1
+        print(f'Rebuilt {count} timelines.')
+
+    @app.cli.command()
+    def recount():
+        """Recompute the denormalized user counters."""
+        from apps.extensions import db
+        from apps.user.models import User
+        User.recount()
+        db.session.commit()
+        print('User counters recomputed.')
+
+    @app.cli.command()
+    @click.option('--reset', is_flag=True, help='Clear the counters afterwards.')
+    def mail_stats(reset):
+        """Show mail delivery throughput."""
+        from apps import mailer
+        data = mailer.stats()
+        rate = data['sent'] / data['seconds'] if data['seconds'] else 0
+        per_batch = data['sent'] / data['batches'] if data['batches'] else 0
+        print(f"Sent {data['sent']}, failed {data['failed']}, retried {data['retried']} "
+              f"in {data['batches']} batches ({per_batch:.1f} per batch, {rate:.1f} per second).")
+        if reset:
+            current_app.redis.delete(mailer.STATS_KEY)
+
+    @app.cli.command()
+    @click.option('--reset', is_flag=True, help='Clear the counters afterwards.')
+    def index_stats(reset):
+        """Show how far the search index lags behind the database."""
+        from apps import search
+        data = search.index_stats()
+        print(f"Indexed {data['documents']} documents in {data['jobs']} jobs, "
+              f"average lag {data['average_lag']:.2f}s, last {data['last_lag']:.2f}s. "
+              f"{data['queued']} jobs waiting in the task queue, "
+              f"{data['deferred']} deferred while search was down.")
+        if reset:
+            current_app.redis.delete(search.INDEX_STATS_KEY)
+
+    @app.cli.command()
+    def search_replay():
+        """Index the changes deferred while Elasticsearch was down."""
+        if not current_app.elasticsearch:
+            print('Elasticsearch is not configured.')
+            return
+        from apps import search
+        count = search.replay()
+        print(f'Replayed {count} index changes, '
+              f'{current_app.redis.llen(search.REPLAY_KEY)} batches still deferred.')
+
+    @app.cli.group()
+    def suggest():
+        """Search type-ahead commands."""
+        pass
+
+    @suggest.command('rebuild')
+    def rebuild_suggest():
+        """Rebuild the username and term prefix index."""
+        from apps.suggest import rebuild as rebuild_index
+        users, terms = rebuild_index()
+        print(f'Indexed {users} usernames and {terms} terms.')
+
+    @app.cli.command()
+    @click.option('--workers', default=None, type=int,
+                  help='Number of detecting processes.')
+    @click.option('--chunk-size', default=None, type=int,
+                  help='Posts per id range handed to a process.')
+    def backfill_languages(workers, chunk_size):
+        """Detect the language of posts that have none."""
+        from apps import language
+        start = time.monotonic()
+
+        def progress(done, total, count):
+            rate = count / (time.monotonic() - start)
+            print(f'{done}/{total} ranges, {count} posts ({rate:.0f} per second)')
+
+        count = language.backfill(workers=workers, size=chunk_size, progress=progress)
+        elapsed = time.monotonic() - start
+        print(f'Detected the language of {count} posts in {elapsed:.1f}s '
+              f'({count / elapsed if elapsed else 0:.0f} per second).')
@@ -1,7 +1,7 @@
 from flask import request
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms import StringField, SubmitField, TextAreaField
+from wtforms.validators import DataRequired, Email, Length
 from flask_babel import lazy_gettext as _l
 
 class SearchForm(FlaskForm):
@@ -12,4 +12,13 @@ class SearchForm(FlaskForm):
             kwargs['formdata'] = request.args
         if 'csrf_enabled' not in kwargs:
             kwargs['csrf_enabled'] = False
-        super(SearchForm, self).__init__(*args, **kwargs)
\ No newline at end of file
+        super(SearchForm, self).__init__(*args, **kwargs)
+
+class SubscribeForm(FlaskForm):
+    email = StringField(_l('Email'), validators=[DataRequired(), Email()])
+    submit = SubmitField(_l('Join the Journey'))
+
+class CampaignForm(FlaskForm):
+    subject = StringField(_l('Subject'), validators=[DataRequired(), Length(max=200)])
+    body = TextAreaField(_l('Message'), validators=[DataRequired()])
+    submit = SubmitField(_l('Send to all subscribers'))
\ No newline at end of file
@@ -0,0 +1,58 @@
+from datetime import datetime
+from time import time
+import jwt
+from flask import current_app
+from apps.extensions import db
+
+class Subscriber(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), index=True, unique=True, nullable=False)
+    locale = db.Column(db.String(5), default='en')
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Newsletters only go to addresses confirmed from the link mailed to them
+    confirmed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    @staticmethod
+    def _token(claim, id, expires_in):
+        return jwt.encode({claim: id, 'exp': time() + expires_in},
+                          current_app.config['SECRET_KEY'], algorithm='HS256')
+
+    @staticmethod
+    def _verify_token(claim, token):
+        try:
+            return jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])[claim]
+        except (jwt.InvalidTokenError, KeyError):
+            return
+
+    def get_confirm_token(self):
+        return Subscriber._token('confirm_subscription', self.id,
+                                 current_app.config['SUBSCRIBE_CONFIRM_TTL'])
+
+    @staticmethod
+    def verify_confirm_token(token):
+        return Subscriber._verify_token('confirm_subscription', token)
+
+    @staticmethod
+    def get_unsubscribe_token(id):
+        return Subscriber._token('unsubscribe', id, current_app.config['UNSUBSCRIBE_TOKEN_TTL'])
+
+    @staticmethod
+    def verify_unsubscribe_token(token):
+        return Subscriber._verify_token('unsubscribe', token)
+
+    def __repr__(self):
+        return f"<Subscriber {self.email}>"
+
+class Translation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # sha256 of the source text, which itself is not kept
+    text_hash = db.Column(db.String(64), nullable=False)
+    source_language = db.Column(db.String(5), nullable=False)
+    dest_language = db.Column(db.String(5), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('text_hash', 'source_language', 'dest_language'),)
+
+    def __repr__(self):
+        return f"<Translation {self.source_language}->{self.dest_language} {self.text_hash[:8]}>"
\ No newline at end of file
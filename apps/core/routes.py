@@ -1,35 +1,115 @@
-from flask import Blueprint, render_template, request, current_app, jsonify, g, redirect, url_for
+from flask import Blueprint, render_template, request, current_app, jsonify, g, redirect, url_for, flash, abort
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 from datetime import datetime
+import redis
 from apps.extensions import db
 from apps.blog.models import Post
-from apps.core.forms import SearchForm
+from apps.blog import rows
+from apps.user.models import Task
+from apps.core.forms import SearchForm, SubscribeForm, CampaignForm
+from apps.core.models import Subscriber
+from apps.user import last_seen
+from apps.user.utils import send_subscribe_confirmation_email
+from apps import suggest as search_suggest
+from apps.fragments import render_posts
 
 # Optional translate import
 try:
-    from apps.translate import translate
+    from apps.translate import translate, translate_batch
 except ImportError:
     def translate(text, source_language, dest_language):
         return _('Translation service not configured.')
 
+    def translate_batch(texts, dest_language):
+        return {id: _('Translation service not configured.') for id in texts}
+
 core_bp = Blueprint('core', __name__, template_folder='../../templates/core')
 
 @core_bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.touch(current_user)
+        last_seen.flush_if_due()
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
+@core_bp.app_context_processor
+def inject_nav_context():
+    return {'nav_context': nav_context}
+
+@core_bp.app_context_processor
+def inject_render_posts():
+    return {'render_posts': render_posts}
+
+def nav_context():
+    # Computed at most once per request, and only by pages that render the nav
+    if 'nav' not in g:
+        tasks = current_user.get_tasks_in_progress()
+        g.nav = {
+            'new_messages': current_user.new_messages(),
+            'tasks': list(zip(tasks, Task.get_progress_many(tasks)))
+        }
+    return g.nav
+
 @core_bp.route('/', methods=['GET'])
 def index():
     return render_template('core/index.html', title=_('Home'), user=current_user)
 
-@core_bp.route('/newsletter', methods=['GET'])
+@core_bp.route('/newsletter', methods=['GET', 'POST'])
 def newsletter():
-    return render_template('core/newsletter.html', title=_('Newsletter'))
+    form = SubscribeForm()
+    if form.validate_on_submit():
+        email = form.email.data.strip().lower()
+        subscriber = db.session.scalar(db.select(Subscriber).where(Subscriber.email == email))
+        if subscriber is None:
+            subscriber = Subscriber(email=email, locale=g.locale)
+            db.session.add(subscriber)
+            db.session.commit()
+        # The same answer either way, so the form does not tell who subscribed
+        if not subscriber.confirmed:
+            send_subscribe_confirmation_email(subscriber)
+        flash(_('Check your email to confirm your subscription.'))
+        return redirect(url_for('core.newsletter'))
+    campaign_form = CampaignForm() \
+        if current_user.is_authenticated and current_user.is_admin() else None
+    return render_template('core/newsletter.html', title=_('Newsletter'), form=form,
+                           campaign_form=campaign_form)
+
+@core_bp.route('/newsletter/confirm')
+def confirm_subscription():
+    id = Subscriber.verify_confirm_token(request.args.get('token', ''))
+    if id is not None:
+        db.session.execute(db.update(Subscriber).where(Subscriber.id == id).values(confirmed=True))
+        db.session.commit()
+        flash(_('Thanks for joining the journey!'))
+    return redirect(url_for('core.newsletter'))
+
+@core_bp.route('/newsletter/send', methods=['POST'])
+@login_required
+def send_newsletter():
+    if not current_user.is_admin():
+        abort(403)
+    form = CampaignForm()
+    if form.validate_on_submit():
+        if current_user.get_task_in_progress('send_newsletter'):
+            flash(_('A newsletter is currently being sent'))
+        else:
+            current_user.launch_task('send_newsletter', _('Sending newsletter...'),
+                                     form.subject.data, form.body.data,
+                                     url_for('core.unsubscribe', _external=True))
+            db.session.commit()
+            flash(_('The newsletter is being sent'))
+    return redirect(url_for('core.newsletter'))
+
+@core_bp.route('/newsletter/unsubscribe')
+def unsubscribe():
+    id = Subscriber.verify_unsubscribe_token(request.args.get('token', ''))
+    if id is not None:
+        db.session.execute(db.delete(Subscriber).where(Subscriber.id == id))
+        db.session.commit()
+        flash(_('You have been unsubscribed.'))
+    return redirect(url_for('core.newsletter'))
 
 @core_bp.route('/search')
 @login_required
@@ -37,8 +117,9 @@ def search():
     if not g.search_form.validate():
         return redirect(url_for('blog.explore'))
     page = request.args.get('page', 1, type=int)
-    posts, total = Post.search(g.search_form.q.data, page,
-                               current_app.config['POSTS_PER_PAGE'])
+    ids, total = Post.search_ids(g.search_form.q.data, page,
+                                 current_app.config['POSTS_PER_PAGE'])
+    posts = rows.by_id(ids)
     next_url = url_for('core.search', q=g.search_form.q.data, page=page + 1) \
         if total > page * current_app.config['POSTS_PER_PAGE'] else None
     prev_url = url_for('core.search', q=g.search_form.q.data, page=page - 1) \
@@ -46,9 +127,46 @@ def search():
     return render_template('core/search.html', title=_('Search'), posts=posts,
                          next_url=next_url, prev_url=prev_url)
 
+@core_bp.route('/search/suggest')
+@login_required
+def suggest():
+    try:
+        result = search_suggest.suggest(request.args.get('q', ''))
+    except redis.exceptions.RedisError:
+        result = {'users': [], 'terms': []}
+    result['users'] = [{'username': username,
+                        'url': url_for('user.profile', username=username)}
+                       for username in result['users']]
+    response = jsonify(result)
+    response.cache_control.private = True
+    response.cache_control.max_age = 30
+    return response
+
 @core_bp.route('/translate', methods=['POST'])
 @login_required
 def translate_text():
     return jsonify({'text': translate(request.form['text'],
                                       request.form['source_language'],
-                                      request.form['dest_language'])})
\ No newline at end of file
+                                      request.form['dest_language'])})
+
+@core_bp.route('/translate/batch', methods=['POST'])
+@login_required
+def translate_posts():
+    """Translate the posts of a page in one go, keyed by post id."""
+    data = request.get_json(silent=True) or {}
+    dest_language = data.get('dest_language') or g.locale
+    if dest_language not in current_app.config['LANGUAGES']:
+        abort(400)
+    try:
+        ids = [int(id) for id in data.get('posts', [])]
+    except (TypeError, ValueError):
+        abort(400)
+    if len(ids) > current_app.config['TRANSLATE_BATCH_LIMIT']:
+        abort(400)
+    posts = db.session.execute(
+        db.select(Post.id, Post.body, Post.language)
+        .where(Post.id.in_(ids), Post.language.is_not(None), Post.language != '',
+               Post.language != dest_language)).all()
+    translations = translate_batch({id: (body, language) for id, body, language in posts},
+                                   dest_language)
+    return jsonify({'translations': translations})
\ No newline at end of file
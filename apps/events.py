@@ -0,0 +1,45 @@
+from apps.extensions import db
+
+def listen(target, identifier, fn):
+    # The session and models are shared by every app in the process, and
+    # a worker may build one next to the web app, so never register twice
+    if not db.event.contains(target, identifier, fn):
+        db.event.listen(target, identifier, fn)
+
+def register_event_handlers():
+    # Search event handlers
+    from apps.search import SearchableMixin
+    listen(db.session, 'after_flush', SearchableMixin.after_flush)
+    listen(db.session, 'after_commit', SearchableMixin.after_commit)
+    listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
+
+    # Cache invalidation handlers
+    from apps import cache
+    listen(db.session, 'after_commit', cache.after_commit)
+    listen(db.session, 'after_rollback', cache.after_rollback)
+    from apps.user.models import User
+    listen(db.session, 'after_flush', User.after_flush)
+    from apps import fragments
+    listen(db.session, 'after_flush', fragments.after_flush)
+
+    # Notification push handlers
+    from apps.user import stream
+    listen(db.session, 'after_commit', stream.after_commit)
+    listen(db.session, 'after_rollback', stream.after_rollback)
+
+    # Type-ahead index handlers
+    from apps import suggest
+    listen(db.session, 'after_flush', suggest.after_flush)
+    listen(db.session, 'after_commit', suggest.after_commit)
+    listen(db.session, 'after_rollback', suggest.after_rollback)
+
+    # Language detection handlers
+    from apps import language
+    listen(db.session, 'after_flush', language.after_flush)
+    listen(db.session, 'after_commit', language.after_commit)
+    listen(db.session, 'after_rollback', language.after_rollback)
+
+    # Timeline event handlers
+    from apps.blog.models import Post
+    listen(Post, 'after_insert', Post.after_insert)
+    listen(Post, 'before_delete', Post.before_delete)
@@ -0,0 +1,70 @@
+"""Rendered blog/_post.html fragments, cached per post, locale and template.
+
+Post listings render through render_posts(), which fetches the fragments of
+a page with one MGET and renders only the misses. The template version is a
+hash of its source, so a deploy that changes the template starts from new
+keys and the old ones expire.
+"""
+from hashlib import sha256
+from flask import current_app, render_template
+from flask_babel import get_locale
+from markupsafe import Markup
+from apps.extensions import db
+from apps import cache
+
+TEMPLATE = 'blog/_post.html'
+
+_version = None
+
+def template_version():
+    global _version
+    # Templates are reloaded on change in debug mode, so check every time
+    if _version is None or current_app.debug:
+        source, filename, uptodate = current_app.jinja_env.loader.get_source(
+            current_app.jinja_env, TEMPLATE)
+        _version = sha256(source.encode()).hexdigest()[:12]
+    return _version
+
+def _key(post_id, locale):
+    return f'{post_id}:{locale}:{template_version()}'
+
+def render_posts(posts):
+    locale = str(get_locale())
+    keys = [_key(post.id, locale) for post in posts]
+    fragments = cache.get_many('fragment', keys)
+    rendered = {key: render_template(TEMPLATE, post=post)
+                for key, post in zip(keys, posts) if key not in fragments}
+    if rendered:
+        cache.set_many('fragment', rendered, current_app.config['FRAGMENT_CACHE_TTL'])
+        fragments.update(rendered)
+    return Markup(''.join(fragments[key] for key in keys))
+
+def _keys(post_ids):
+    return [_key(id, locale) for id in post_ids for locale in current_app.config['LANGUAGES']]
+
+def invalidate(*post_ids):
+    if post_ids:
+        cache.invalidate('fragment', *_keys(post_ids))
+
+def after_flush(session, flush_context):
+    from apps.user.models import User
+    from apps.blog.models import Post
+    post_ids = set()
+    authors = set()
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Post):
+            state = db.inspect(obj)
+            if obj in session.deleted or any(state.attrs[field].history.has_changes()
+                                             for field in ('body', 'language', 'user_id')):
+                post_ids.add(obj.id)
+        elif isinstance(obj, User):
+            state = db.inspect(obj)
+            if obj in session.deleted or state.attrs.username.history.has_changes() \
+                    or state.attrs.email.history.has_changes():
+                authors.add(obj.id)
+    if authors:
+        # The name and avatar of the author are in every one of their posts
+        post_ids.update(session.scalars(
+            db.select(Post.id).where(Post.user_id.in_(authors))))
+    if post_ids:
+        cache.invalidate_on_commit('fragment', *_keys(post_ids))
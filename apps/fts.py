@@ -0,0 +1,89 @@
+"""SQLite FTS5 search, used when Elasticsearch is not configured.
+
+Every searchable model gets a "<table>_fts" virtual table whose rowid is the
+id of the row it indexes. It is created and dropped with the model's table
+and written in the same transaction as the rows, from the flush hook.
+"""
+import sqlite3
+import sqlalchemy as sa
+from apps.extensions import db
+
+_supported = None
+
+def table_name(model):
+    return f'{model.__tablename__}_fts'
+
+def available():
+    # FTS5 support is a property of the SQLite library, so probe it once on
+    # a private connection rather than on one that may be in a transaction
+    global _supported
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    if _supported is None:
+        connection = sqlite3.connect(':memory:')
+        try:
+            connection.execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(x)')
+            _supported = True
+        except sqlite3.OperationalError:
+            _supported = False
+        finally:
+            connection.close()
+    return _supported
+
+def register(model):
+    name = table_name(model)
+    columns = ', '.join(model.__searchable__)
+    db.event.listen(model.__table__, 'after_create', sa.DDL(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({columns}, "
+        f"tokenize='unicode61 remove_diacritics 2')").execute_if(dialect='sqlite'))
+    db.event.listen(model.__table__, 'before_drop', sa.DDL(
+        f'DROP TABLE IF EXISTS {name}').execute_if(dialect='sqlite'))
+
+def update(connection, models, changes):
+    """Apply {(index, id): object or None} changes within the flush."""
+    deleted = {}
+    inserted = {}
+    for (index, id), obj in changes.items():
+        deleted.setdefault(index, []).append({'id': id})
+        if obj is not None:
+            inserted.setdefault(index, []).append(
+                dict({field: getattr(obj, field) for field in obj.__searchable__}, id=id))
+    for index, rows in deleted.items():
+        name = table_name(models[index])
+        connection.execute(sa.text(f'DELETE FROM {name} WHERE rowid = :id'), rows)
+    for index, rows in inserted.items():
+        model = models[index]
+        fields = model.__searchable__
+        connection.execute(sa.text(
+            f"INSERT INTO {table_name(model)} (rowid, {', '.join(fields)}) "
+            f"VALUES (:id, {', '.join(':' + field for field in fields)})"), rows)
+
+def rebuild(model):
+    name = table_name(model)
+    fields = ', '.join(model.__searchable__)
+    db.session.execute(sa.text(f'DELETE FROM {name}'))
+    db.session.execute(sa.text(
+        f'INSERT INTO {name} (rowid, {fields}) SELECT id, {fields} FROM {model.__tablename__}'))
+
+def match_expression(expression):
+    # Every word is quoted, so user input is never parsed as FTS5 syntax
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in expression.split())
+
+def search(model, expression, page, per_page):
+    """One query for the page of rows, ranked by bm25, and the total."""
+    match = match_expression(expression)
+    if not match:
+        return [], 0
+    name = table_name(model)
+    fts = sa.table(name, sa.column('rowid'))
+    # Ranking has to happen in the full-text query itself, so the matches
+    # are a subquery that the rows and the window count are joined to
+    matches = db.select(fts.c.rowid, db.func.bm25(sa.literal_column(name)).label('rank')) \
+        .select_from(fts) \
+        .where(sa.literal_column(name).op('MATCH')(match)).subquery()
+    rows = db.session.execute(
+        db.select(model, db.func.count().over())
+        .join(matches, matches.c.rowid == model.id)
+        .order_by(matches.c.rank, model.id)
+        .limit(per_page).offset((page - 1) * per_page)).all()
+    return [row[0] for row in rows], rows[0][1] if rows else 0
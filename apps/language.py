@@ -0,0 +1,102 @@
+"""Language of posts, detected off the request path.
+
+Posts are saved without a language. The commit hook queues one job for the
+posts of the commit, and `flask backfill-languages` fills in older posts and
+any whose job was lost.
+"""
+from hashlib import sha256
+import redis
+from flask import current_app
+from apps.extensions import db
+from apps import cache, fragments
+from apps.pool import map_ranges
+
+try:
+    from langdetect import DetectorFactory, LangDetectException, detect
+    # langdetect samples the text at random; a fixed seed makes the same
+    # text always get the same language
+    DetectorFactory.seed = 0
+except ImportError:
+    detect = None
+
+def detect_language(text):
+    if detect is None or not text or not text.strip():
+        return ''
+    key = sha256(text.encode()).hexdigest()
+    language = cache.get('language', key)
+    if language is None:
+        try:
+            language = detect(text)[:5]
+        except LangDetectException:
+            language = ''
+        cache.set('language', key, language, current_app.config['LANGUAGE_CACHE_TTL'])
+    return language
+
+def _detect(rows):
+    # (id, body) rows, written with one executemany
+    from apps.blog.models import Post
+    if rows:
+        db.session.execute(db.update(Post), [
+            {'id': id, 'language': detect_language(body)} for id, body in rows])
+        db.session.commit()
+        # The bulk update bypasses the flush hooks; the language decides
+        # whether a post shows a translate link
+        fragments.invalidate(*[id for id, body in rows])
+    return len(rows)
+
+def detect_languages(ids):
+    """Detect and store the language of those posts that have none yet."""
+    from apps.blog.models import Post
+    return _detect(db.session.execute(
+        db.select(Post.id, Post.body).where(Post.id.in_(ids), Post.language.is_(None))).all())
+
+def after_flush(session, flush_context):
+    from apps.blog.models import Post
+    ids = [obj.id for obj in session.new if isinstance(obj, Post) and obj.language is None]
+    if ids:
+        session.info.setdefault('detect_languages', []).extend(ids)
+
+def after_commit(session):
+    ids = session.info.pop('detect_languages', None)
+    if ids:
+        try:
+            current_app.task_queue.enqueue('apps.tasks.detect_languages', ids)
+        except redis.exceptions.RedisError:
+            # left without a language until the next backfill
+            pass
+
+def after_rollback(session):
+    session.info.pop('detect_languages', None)
+
+def _backfill_range(first, last):
+    from apps.blog.models import Post
+    return _detect(db.session.execute(
+        db.select(Post.id, Post.body)
+        .where(Post.id >= first, Post.id < last, Post.language.is_(None))).all())
+
+def backfill(workers=None, size=None, progress=None):
+    """Detect the language of every post without one, in parallel id ranges.
+
+    progress is called with the finished and total number of ranges and the
+    posts updated so far. Returns the number of posts updated.
+    """
+    from apps.blog.models import Post
+    workers = workers or current_app.config['LANGUAGE_BACKFILL_WORKERS']
+    size = size or current_app.config['LANGUAGE_BACKFILL_CHUNK_SIZE']
+    low, high = db.session.execute(
+        db.select(db.func.min(Post.id), db.func.max(Post.id))
+        .where(Post.language.is_(None))).one()
+    if low is None:
+        return 0
+    ranges = range(low, high + 1, size)
+    done = count = 0
+
+    def finished(first, updated):
+        nonlocal done, count
+        done += 1
+        count += updated
+        if progress:
+            progress(done, len(ranges), count)
+
+    map_ranges(_backfill_range, (), ranges, size, workers, finished)
+    return count
@@ -0,0 +1,123 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+import redis
+from flask import current_app
+from flask_mail import BadHeaderError
+from apps.extensions import mail
+
+STATS_KEY = 'mail-stats'
+
+def _permanent(error):
+    # Rejected by the server for good; sending again will not help
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, BadHeaderError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+def deliver(app, messages):
+    """Send messages over one SMTP connection, retrying with backoff.
+
+    A dropped connection or a temporary failure reconnects and resumes with
+    the first unsent message; messages the server rejects permanently are
+    logged and skipped.
+    """
+    pending = list(messages)
+    sent = failed = retried = 0
+    start = time.monotonic()
+    for attempt in range(app.config['MAIL_RETRIES'] + 1):
+        if attempt:
+            time.sleep(min(app.config['MAIL_RETRY_DELAY'] * 2 ** (attempt - 1), 60))
+            retried += len(pending)
+        try:
+            with mail.connect() as connection:
+                while pending:
+                    try:
+                        connection.send(pending[0])
+                        sent += 1
+                    except Exception as e:
+                        if not _permanent(e):
+                            raise
+                        app.logger.error('Mail rejected', exc_info=e)
+                        failed += 1
+                    pending.pop(0)
+        except (smtplib.SMTPException, OSError) as e:
+            app.logger.warning(f'Mail delivery attempt {attempt + 1} failed: {e}')
+        if not pending:
+            break
+    if pending:
+        app.logger.error(f'Giving up on {len(pending)} messages')
+        failed += len(pending)
+    _record(app, sent, failed, retried, time.monotonic() - start)
+    return sent
+
+def _record(app, sent, failed, retried, seconds):
+    try:
+        pipe = app.redis.pipeline()
+        pipe.hincrby(STATS_KEY, 'sent', sent)
+        pipe.hincrby(STATS_KEY, 'failed', failed)
+        pipe.hincrby(STATS_KEY, 'retried', retried)
+        pipe.hincrby(STATS_KEY, 'batches', 1)
+        pipe.hincrbyfloat(STATS_KEY, 'seconds', seconds)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+def stats():
+    """Delivery counters of all processes since the last reset."""
+    data = {k.decode(): float(v) for k, v in current_app.redis.hgetall(STATS_KEY).items()}
+    for name in ('sent', 'failed', 'retried', 'batches'):
+        data[name] = int(data.get(name, 0))
+    data['seconds'] = data.get('seconds', 0.0)
+    return data
+
+class Mailer(object):
+    """Delivers mail from a bounded queue on a few long-lived threads.
+
+    Each thread takes whatever has been queued, up to MAIL_BATCH_SIZE
+    messages, and sends it over a single SMTP connection, so a burst costs
+    one handshake per batch instead of a thread and a handshake per message.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self, app):
+        # Threads do not survive a fork, so start them lazily per process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+                for _ in range(app.config['MAIL_WORKERS']):
+                    threading.Thread(target=self._run, args=(app, self._queue),
+                                     daemon=True).start()
+
+    def send(self, msg, sync=False):
+        app = current_app._get_current_object()
+        if sync:
+            return deliver(app, [msg])
+        self._start(app)
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            # Slow the sender down rather than let the backlog grow
+            deliver(app, [msg])
+
+    def _run(self, app, q):
+        while True:
+            batch = [q.get()]
+            while len(batch) < app.config['MAIL_BATCH_SIZE']:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            with app.app_context():
+                try:
+                    deliver(app, batch)
+                except Exception as e:
+                    app.logger.error('Unhandled exception in mail delivery', exc_info=e)
+
+mailer = Mailer()
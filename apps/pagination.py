@@ -0,0 +1,81 @@
+from datetime import datetime
+from flask import request, url_for
+from apps.extensions import db
+
+def encode_cursor(item):
+    return f'{item.timestamp.isoformat()}_{item.id}'
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+def _seek(query, timestamp, id, per_page, after, before):
+    # Up to per_page + 1 rows past the cursor, in the order they are read.
+    # The redundant bound on timestamp lets the database range-scan an index.
+    query = query.order_by(None)
+    if before:
+        return query.filter(timestamp >= before[0], db.or_(
+            timestamp > before[0], id > before[1]
+        )).order_by(timestamp.asc(), id.asc()).limit(per_page + 1).all()
+    if after:
+        query = query.filter(timestamp <= after[0], db.or_(
+            timestamp < after[0], id < after[1]
+        ))
+    return query.order_by(timestamp.desc(), id.desc()).limit(per_page + 1).all()
+
+def keyset_paginate(query, model, per_page, after=None, before=None):
+    """Seek to a page by (timestamp, id) instead of counting and offsetting.
+
+    query may also be a list of (query, timestamp, id) branches of a union.
+    Each branch seeks on its own columns, so each can use its own index, and
+    their pages are merged; a row found by several branches is listed once.
+
+    Returns the items newest first, plus cursors for the older and newer
+    neighbouring pages (None when there is nothing in that direction).
+    """
+    branches = query if isinstance(query, list) else [(query, model.timestamp, model.id)]
+    found = {}
+    for branch, timestamp, id in branches:
+        for row in _seek(branch, timestamp, id, per_page, after, before):
+            found[row.id] = row
+    rows = sorted(found.values(), key=lambda row: (row.timestamp, row.id),
+                  reverse=not before)[:per_page + 1]
+    if before:
+        has_newer, has_older = len(rows) > per_page, True
+        items = rows[:per_page][::-1]
+    else:
+        has_newer, has_older = after is not None, len(rows) > per_page
+        items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1]) if items and has_older else None
+    prev_cursor = encode_cursor(items[0]) if items and has_newer else None
+    return items, next_cursor, prev_cursor
+
+def paginate_listing(query, model, endpoint, per_page, **kwargs):
+    """Paginate a listing for a view, returning (items, next_url, prev_url).
+
+    Requests carrying ?page= keep the original offset pagination, everything
+    else uses the count-free keyset cursors (?after= / ?before=).
+    """
+    if 'page' in request.args:
+        if isinstance(query, list):
+            # Offsets need the branches as one sorted union
+            query = query[0][0].union(*[branch for branch, timestamp, id in query[1:]]) \
+                .order_by(model.timestamp.desc())
+        page = request.args.get('page', 1, type=int)
+        resources = query.paginate(page=page, per_page=per_page, error_out=False)
+        next_url = url_for(endpoint, page=resources.next_num, **kwargs) \
+            if resources.has_next else None
+        prev_url = url_for(endpoint, page=resources.prev_num, **kwargs) \
+            if resources.has_prev else None
+        return resources.items, next_url, prev_url
+
+    items, next_cursor, prev_cursor = keyset_paginate(
+        query, model, per_page,
+        after=decode_cursor(request.args.get('after')),
+        before=decode_cursor(request.args.get('before')))
+    next_url = url_for(endpoint, after=next_cursor, **kwargs) if next_cursor else None
+    prev_url = url_for(endpoint, before=prev_cursor, **kwargs) if prev_cursor else None
+    return items, next_url, prev_url
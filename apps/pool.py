@@ -0,0 +1,38 @@
+"""Commands that work through a table in id ranges with a pool of processes.
+
+The search reindex and the language backfill split the ids of a table into
+ranges of a fixed size and hand each to a worker process. The workers are
+forked from the command, so they share its app but open their own database
+connections.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import current_app
+from apps.extensions import db
+
+def _init_worker(app, setup):
+    # Forked from the command: connections of the parent must not be reused
+    app.app_context().push()
+    db.engine.dispose(close=False)
+    if setup:
+        setup(app)
+
+def map_ranges(fn, args, firsts, size, workers, finished, setup=None):
+    """Call fn(*args, first, first + size) for every first.
+
+    finished(first, result) is called in this process as each range is
+    done, in the order they finish. fn must be a module-level function; with
+    more than one worker it runs in forked processes, where setup(app) can
+    replace other connections inherited from the command.
+    """
+    if workers == 1:
+        for first in firsts:
+            finished(first, fn(*args, first, first + size))
+        return
+    db.session.remove()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker,
+                             initargs=(current_app._get_current_object(), setup)) as pool:
+        futures = {pool.submit(fn, *args, first, first + size): first for first in firsts}
+        for future in as_completed(futures):
+            finished(futures[future], future.result())
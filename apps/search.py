@@ -1,18 +1,19 @@
+import json
+import time
+from datetime import timedelta
+from hashlib import sha256
+import redis
 from flask import current_app
+from rq import Retry
 from apps.extensions import db
+from apps import cache, fts
+from apps.pool import map_ranges
+from apps.search_client import SearchUnavailable, create_client
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, body=payload)
-
-def remove_from_index(index, model):
-    if not current_app.elasticsearch:
-        return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+INDEX_STATS_KEY = 'search-index-stats'
+REINDEX_KEY_PREFIX = 'reindex:'
+GENERATION_KEY_PREFIX = 'search-generation:'
+REPLAY_KEY = 'search-replay'
 
 def query_index(index, query, page, per_page):
     if not current_app.elasticsearch:
@@ -24,47 +25,386 @@ def query_index(index, query, page, per_page):
     ids = [int(hit['_id']) for hit in search['hits']['hits']]
     return ids, search['hits']['total']['value']
 
+def bump_generation(*indexes):
+    """Make every cached result of these indexes unreachable."""
+    try:
+        pipe = current_app.redis.pipeline()
+        for index in indexes:
+            pipe.incr(f'{GENERATION_KEY_PREFIX}{index}')
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+def _result_key(index, expression, page, per_page):
+    # The generation is part of the key, so a bump leaves old entries to
+    # expire instead of having to find and delete them. Without Redis the
+    # generation is unknown and nothing is cached.
+    try:
+        generation = current_app.redis.get(f'{GENERATION_KEY_PREFIX}{index}')
+    except redis.exceptions.RedisError:
+        return None
+    query = sha256(' '.join(expression.lower().split()).encode()).hexdigest()
+    return f'{index}:{int(generation or 0)}:{page}:{per_page}:{query}'
+
+def _searchable_models():
+    return {mapper.class_.__tablename__: mapper.class_
+            for mapper in db.Model.registry.mappers
+            if issubclass(mapper.class_, SearchableMixin)}
+
+def queue_index_changes(changes):
+    """Ship index changes to the worker as one bulk job, retried on failure.
+
+    Falls back to indexing in this process when the queue is unreachable,
+    and goes straight to the replay queue while the breaker is open.
+    """
+    if not current_app.elasticsearch.available:
+        defer(changes)
+        return
+    try:
+        current_app.task_queue.enqueue(
+            'apps.tasks.index_documents', changes, time.time(),
+            retry=Retry(max=current_app.config['SEARCH_INDEX_RETRIES'],
+                        interval=[10, 30, 60, 120, 300]))
+    except redis.exceptions.RedisError:
+        # Called after a commit, when the committing session can not be used
+        try:
+            with db.orm.Session(db.engine) as session:
+                bulk_index(changes, session)
+        except SearchUnavailable:
+            _lost(changes)
+
+def defer(changes):
+    """Keep changes for replay once Elasticsearch is reachable again."""
+    try:
+        current_app.redis.rpush(REPLAY_KEY, json.dumps(changes))
+        schedule_replay()
+    except redis.exceptions.RedisError:
+        _lost(changes)
+
+def _lost(changes):
+    current_app.logger.error(f'Search and Redis are down, {len(changes)} index changes lost')
+
+def schedule_replay():
+    # One replay job per breaker period, due when the breaker closes
+    reset = current_app.config['SEARCH_BREAKER_RESET']
+    if current_app.redis.set(f'{REPLAY_KEY}:scheduled', 1, nx=True, ex=reset):
+        current_app.task_queue.enqueue_in(timedelta(seconds=reset),
+                                          'apps.tasks.replay_index_changes')
+
+def replay(batch=100):
+    """Index the deferred changes, batch deferred jobs per bulk request.
+
+    Stops and puts the current batch back if Elasticsearch fails again.
+    Returns the number of changes that were indexed.
+    """
+    r = current_app.redis
+    lock = f'{REPLAY_KEY}:lock'
+    if not r.set(lock, 1, nx=True, ex=300):
+        return 0
+    count = 0
+    try:
+        while True:
+            pipe = r.pipeline()
+            pipe.lrange(REPLAY_KEY, 0, batch - 1)
+            pipe.ltrim(REPLAY_KEY, batch, -1)
+            entries = pipe.execute()[0]
+            if not entries:
+                break
+            # Documents are read when indexing, so only the last op per id matters
+            changes = {}
+            for entry in entries:
+                changes.update({(index, id): op for index, id, op in json.loads(entry)})
+            try:
+                failed = bulk_index([(index, id, op) for (index, id), op in changes.items()])
+            except SearchUnavailable:
+                r.lpush(REPLAY_KEY, *reversed(entries))
+                break
+            if failed:
+                current_app.logger.error(f'{failed} replayed search index updates failed')
+            count += len(changes)
+    finally:
+        r.delete(lock)
+    return count
+
+def _document(obj):
+    return {field: getattr(obj, field) for field in obj.__searchable__}
+
+def bulk_index(changes, session=None):
+    """Apply (index, id, op) changes with a single bulk request.
+
+    Documents are read from the database when the job runs, so a retried or
+    late job always writes the current state, and rows that no longer
+    exist are removed. Returns the number of documents that failed.
+    """
+    if not current_app.elasticsearch or not changes:
+        return 0
+    session = session or db.session
+    models = _searchable_models()
+    ids = {}
+    for index, id, op in changes:
+        ids.setdefault(index, set()).add(id)
+    operations = []
+    for index, index_ids in ids.items():
+        model = models[index]
+        objects = {obj.id: obj for obj in session.scalars(
+            db.select(model).where(model.id.in_(index_ids)))}
+        # While a reindex is building a new index, it gets every change too
+        targets = [index]
+        building = reindex_target(index)
+        if building:
+            targets.append(building)
+        for id in sorted(index_ids):
+            obj = objects.get(id)
+            for target in targets:
+                if obj is None:
+                    operations.append({'delete': {'_index': target, '_id': id}})
+                else:
+                    operations.append({'index': {'_index': target, '_id': id}})
+                    operations.append(_document(obj))
+    es = current_app.elasticsearch.options(
+        request_timeout=current_app.config['SEARCH_INDEX_TIMEOUT'])
+    response = es.bulk(operations=operations)
+    failed = 0
+    if response['errors']:
+        for item in response['items']:
+            action, result = next(iter(item.items()))
+            # deleting a document that was never indexed is not an error
+            if result.get('error') and not (action == 'delete' and result['status'] == 404):
+                failed += 1
+    # Results cached since the commit may predate these documents
+    bump_generation(*ids)
+    return failed
+
+def record_index_lag(documents, lag):
+    try:
+        pipe = current_app.redis.pipeline()
+        pipe.hincrby(INDEX_STATS_KEY, 'jobs', 1)
+        pipe.hincrby(INDEX_STATS_KEY, 'documents', documents)
+        pipe.hincrbyfloat(INDEX_STATS_KEY, 'lag', lag)
+        pipe.hset(INDEX_STATS_KEY, 'last_lag', lag)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+def index_stats():
+    """Indexing lag since the last reset, plus the changes still queued."""
+    data = {k.decode(): float(v) for k, v in current_app.redis.hgetall(INDEX_STATS_KEY).items()}
+    jobs = int(data.get('jobs', 0))
+    return {
+        'jobs': jobs,
+        'documents': int(data.get('documents', 0)),
+        'average_lag': data.get('lag', 0.0) / jobs if jobs else 0.0,
+        'last_lag': data.get('last_lag', 0.0),
+        'queued': current_app.task_queue.count,
+        'deferred': current_app.redis.llen(REPLAY_KEY),
+    }
+
 class SearchableMixin(object):
+    """Full-text search over the __searchable__ columns of a model.
+
+    Elasticsearch is used when configured. Otherwise SQLite databases use an
+    FTS5 table kept up to date in the same transaction, and anything else
+    falls back to LIKE. LIKE is also used while Elasticsearch is down.
+    """
+
     @classmethod
     def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            # Fallback to simple SQL LIKE search if Elasticsearch is not available
-            if not current_app.elasticsearch:
-                return cls.query.filter(
-                    cls.body.contains(expression)).order_by(
-                    cls.timestamp.desc()).paginate(
-                    page=page, per_page=per_page, error_out=False).items, \
-                    cls.query.filter(cls.body.contains(expression)).count()
-            return cls.query.filter_by(id=0), 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        return cls.query.filter(cls.id.in_(ids)).order_by(
-            db.case(when, value=cls.id)), total
+        ids, total, items = cls._search_cached(expression, page, per_page)
+        return (cls._rows(ids) if items is None else items), total
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def search_ids(cls, expression, page, per_page):
+        """Like search, for callers that load the rows themselves."""
+        ids, total, items = cls._search_cached(expression, page, per_page)
+        return ids, total
 
     @classmethod
-    def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
+    def _search_cached(cls, expression, page, per_page):
+        # (ids, total, objects), where objects is None on a cache hit
+        key = _result_key(cls.__tablename__, expression, page, per_page)
+        cached = cache.get('search', key) if key else None
+        if cached is not None:
+            ids, total = cached
+            return ids, total, None
+        items, total, exact = cls._search(expression, page, per_page)
+        ids = [obj.id for obj in items]
+        # Fallback results are not what the index would return, so they are
+        # not cached past the outage
+        if key and exact:
+            cache.set('search', key, [ids, total], current_app.config['SEARCH_CACHE_TTL'])
+        return ids, total, items
+
+    @classmethod
+    def _rows(cls, ids):
+        # One IN query, put back in the order of ids
+        objects = {obj.id: obj for obj in db.session.scalars(
+            db.select(cls).where(cls.id.in_(ids)))} if ids else {}
+        return [objects[id] for id in ids if id in objects]
+
+    @classmethod
+    def _search(cls, expression, page, per_page):
+        if current_app.elasticsearch:
+            try:
+                ids, total = query_index(cls.__tablename__, expression, page, per_page)
+                return cls._rows(ids), total, True
+            except SearchUnavailable:
+                pass
+        elif fts.available():
+            return fts.search(cls, expression, page, per_page) + (True,)
+        rows = db.session.execute(
+            db.select(cls, db.func.count().over())
+            .where(db.or_(*[getattr(cls, field).contains(expression)
+                            for field in cls.__searchable__]))
+            .order_by(cls.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)).all()
+        return [row[0] for row in rows], rows[0][1] if rows else 0, \
+            not current_app.elasticsearch
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        # Collected per flush, since objects flushed before the commit are no
+        # longer in session.new or session.dirty by the time it happens
+        changes = {}
+        for obj in session.new:
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
+                changes[(obj.__tablename__, obj.id)] = obj
+        for obj in session.dirty:
+            if isinstance(obj, SearchableMixin) and session.is_modified(obj) and any(
+                    db.inspect(obj).attrs[field].history.has_changes()
+                    for field in obj.__searchable__):
+                changes[(obj.__tablename__, obj.id)] = obj
+        for obj in session.deleted:
             if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+                changes[(obj.__tablename__, obj.id)] = None
+        if not changes:
+            return
+        session.info.setdefault('search_generations', set()).update(
+            index for index, id in changes)
+        if current_app.elasticsearch:
+            session.info.setdefault('search_changes', {}).update(
+                {key: 'index' if obj is not None else 'delete' for key, obj in changes.items()})
+        elif fts.available():
+            fts.update(session.connection(), _searchable_models(), changes)
+
+    @classmethod
+    def after_commit(cls, session):
+        indexes = session.info.pop('search_generations', None)
+        if indexes:
+            bump_generation(*indexes)
+        changes = session.info.pop('search_changes', None)
+        if changes:
+            queue_index_changes([(index, id, op) for (index, id), op in changes.items()])
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search_generations', None)
+        session.info.pop('search_changes', None)
 
     @classmethod
-    def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
\ No newline at end of file
+    def reindex(cls, workers=None, resume=False, progress=None):
+        if not current_app.elasticsearch and fts.available():
+            fts.rebuild(cls)
+            db.session.commit()
+            bump_generation(cls.__tablename__)
+            return db.session.scalar(db.select(db.func.count(cls.id)))
+        return reindex(cls, workers=workers, resume=resume, progress=progress)
+
+db.event.listen(SearchableMixin, 'instrument_class',
+                lambda mapper, cls: fts.register(cls), propagate=True)
+
+def reindex_target(index):
+    try:
+        target = current_app.redis.hget(f'{REINDEX_KEY_PREFIX}{index}', 'index')
+    except redis.exceptions.RedisError:
+        return None
+    return target.decode() if target else None
+
+def _init_reindex_worker(app):
+    # The client's connections belong to the command as well
+    app.elasticsearch = create_client(app)
+
+def _reindex_partition(model, target, first, last):
+    """Bulk index the rows with first <= id < last into target."""
+    count = 0
+    query = db.select(model).where(model.id >= first, model.id < last) \
+        .order_by(model.id) \
+        .execution_options(yield_per=current_app.config['SEARCH_REINDEX_BATCH_SIZE'])
+    for objects in db.session.scalars(query).partitions():
+        operations = []
+        for obj in objects:
+            operations.append({'index': {'_index': target, '_id': obj.id}})
+            operations.append(_document(obj))
+        es = current_app.elasticsearch.options(
+            request_timeout=current_app.config['SEARCH_INDEX_TIMEOUT'])
+        response = es.bulk(operations=operations)
+        if response['errors']:
+            raise RuntimeError(f'Bulk indexing {target} failed for ids {first} to {last}')
+        count += len(objects)
+    db.session.remove()
+    return count
+
+def reindex(model, workers=None, resume=False, progress=None):
+    """Rebuild the index of model in a new index, then point the alias at it.
+
+    The table is split into id ranges that are streamed and bulk indexed by
+    a pool of processes. Finished ranges are checkpointed in Redis, so with
+    resume=True an interrupted run continues where it stopped. Searches keep
+    using the old index until the alias is switched at the end.
+    """
+    es = current_app.elasticsearch
+    if not es:
+        return 0
+    alias = model.__tablename__
+    key = f'{REINDEX_KEY_PREFIX}{alias}'
+    workers = workers or current_app.config['SEARCH_REINDEX_WORKERS']
+    size = current_app.config['SEARCH_REINDEX_PARTITION_SIZE']
+
+    target = reindex_target(alias) if resume else None
+    if target is None:
+        current_app.redis.delete(key, f'{key}:done')
+        target = f'{alias}-{int(time.time())}'
+        # Replicas and refreshes are turned back on once the index is full
+        es.indices.create(index=target, settings={
+            'number_of_replicas': 0, 'refresh_interval': '-1'})
+        current_app.redis.hset(key, mapping={'index': target, 'size': size})
+    else:
+        size = int(current_app.redis.hget(key, 'size'))
+    done = {int(first) for first in current_app.redis.smembers(f'{key}:done')}
+
+    # Ranges are aligned to multiples of size, so a resumed run splits the same way
+    low, high = db.session.execute(db.select(db.func.min(model.id), db.func.max(model.id))).one()
+    partitions = [] if low is None else \
+        [first for first in range(low - low % size, high + 1, size) if first not in done]
+    total = len(partitions) + len(done)
+    completed = len(done)
+    count = 0
+
+    def finished(first, indexed):
+        nonlocal completed, count
+        completed += 1
+        count += indexed
+        current_app.redis.sadd(f'{key}:done', first)
+        if progress:
+            progress(completed, total)
+
+    map_ranges(_reindex_partition, (model, target), partitions, size, workers, finished,
+               setup=_init_reindex_worker)
+
+    # Switch the alias in one atomic request; a concrete index with the
+    # alias name, left from before aliases were used, is dropped with it
+    es.indices.put_settings(index=target, settings={
+        'number_of_replicas': current_app.config['SEARCH_REPLICAS'], 'refresh_interval': None})
+    es.indices.refresh(index=target)
+    actions = [{'add': {'index': target, 'alias': alias}}]
+    old = []
+    if es.indices.exists_alias(name=alias):
+        old = [index for index in es.indices.get_alias(name=alias) if index != target]
+        actions = [{'remove': {'index': index, 'alias': alias}} for index in old] + actions
+    elif es.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    es.indices.update_aliases(actions=actions)
+    for index in old:
+        es.indices.delete(index=index)
+    current_app.redis.delete(key, f'{key}:done')
+    bump_generation(alias)
+    return count
\ No newline at end of file
@@ -0,0 +1,111 @@
+import time
+import redis
+
+class SearchUnavailable(Exception):
+    """Elasticsearch failed, timed out, or the circuit breaker is open."""
+
+class CircuitBreaker(object):
+    """Opens after THRESHOLD consecutive failures and stays open RESET seconds.
+
+    State is kept in Redis so that every web and worker process sees the
+    same breaker, with a per-process fallback while Redis is unreachable.
+    When the breaker closes again the next call is a trial: one more
+    failure opens it right away, a success clears the count.
+    """
+
+    def __init__(self, redis_client, threshold=5, reset_after=30, name='search-breaker'):
+        self.redis = redis_client
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures_key = f'{name}:failures'
+        self.open_key = f'{name}:open'
+        self._failures = 0
+        self._open_until = 0
+
+    def allow(self):
+        try:
+            return not self.redis.exists(self.open_key)
+        except redis.exceptions.RedisError:
+            return time.monotonic() >= self._open_until
+
+    def success(self):
+        # The count is shared, so clear it even when only other processes failed
+        self._failures = 0
+        try:
+            self.redis.delete(self.failures_key)
+        except redis.exceptions.RedisError:
+            pass
+
+    def failure(self):
+        self._failures += 1
+        try:
+            pipe = self.redis.pipeline()
+            pipe.incr(self.failures_key)
+            pipe.expire(self.failures_key, self.reset_after * 2)
+            failures = pipe.execute()[0]
+        except redis.exceptions.RedisError:
+            failures = self._failures
+        if failures >= self.threshold:
+            self._open_until = time.monotonic() + self.reset_after
+            try:
+                self.redis.set(self.open_key, 1, ex=self.reset_after)
+            except redis.exceptions.RedisError:
+                pass
+
+class SearchClient(object):
+    """Wraps an Elasticsearch client so every call goes through the breaker.
+
+    Connection errors, timeouts and 5xx or 429 responses count as failures
+    and are raised as SearchUnavailable; other API errors pass through.
+    Namespaces such as client.indices are wrapped the same way.
+    """
+
+    def __init__(self, client, breaker):
+        self._client = client
+        self.breaker = breaker
+
+    @property
+    def available(self):
+        return self.breaker.allow()
+
+    def options(self, **kwargs):
+        return SearchClient(self._client.options(**kwargs), self.breaker)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return SearchClient(attr, self.breaker)
+
+        def call(*args, **kwargs):
+            from elasticsearch import ApiError, TransportError
+            if not self.breaker.allow():
+                raise SearchUnavailable('circuit breaker is open')
+            try:
+                result = attr(*args, **kwargs)
+            except TransportError as e:
+                self.breaker.failure()
+                raise SearchUnavailable(str(e)) from e
+            except ApiError as e:
+                if e.meta.status >= 500 or e.meta.status == 429:
+                    self.breaker.failure()
+                    raise SearchUnavailable(str(e)) from e
+                raise
+            self.breaker.success()
+            return result
+        return call
+
+def create_client(app):
+    """The search client for app, or None without ELASTICSEARCH_URL."""
+    if not app.config.get('ELASTICSEARCH_URL'):
+        return None
+    try:
+        from elasticsearch import Elasticsearch
+    except ImportError:
+        return None
+    # Retrying a slow cluster only makes the caller wait longer
+    client = Elasticsearch([app.config['ELASTICSEARCH_URL']],
+                           request_timeout=app.config['SEARCH_TIMEOUT'],
+                           max_retries=0, retry_on_timeout=False)
+    return SearchClient(client, CircuitBreaker(
+        app.redis, threshold=app.config['SEARCH_BREAKER_THRESHOLD'],
+        reset_after=app.config['SEARCH_BREAKER_RESET']))
@@ -0,0 +1,129 @@
+"""Prefix index for the type-ahead on the search box.
+
+Usernames and frequent words from posts are kept in Redis sorted sets with
+equal scores, so a prefix lookup is one ZRANGEBYLEX. The sets are updated
+from the commit hooks and can be rebuilt with `flask suggest rebuild`.
+"""
+import re
+from collections import Counter
+import redis
+from flask import current_app
+from apps.extensions import db
+
+USERS_KEY = 'suggest:users'
+TERMS_KEY = 'suggest:terms'
+TERM_COUNTS_KEY = 'suggest:term-counts'
+
+_word = re.compile(r'[^\W\d_]{3,30}')
+
+def words(text):
+    return Counter(word.lower() for word in _word.findall(text or ''))
+
+def _user_entry(username):
+    # Matched on the lowercase name, displayed with the original case
+    return f'{username.lower()}\x00{username}'
+
+def after_flush(session, flush_context):
+    from apps.user.models import User
+    from apps.blog.models import Post
+    changes = session.info.setdefault('suggest', {'users': {}, 'terms': Counter()})
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes['users'][obj.username] = True
+        elif isinstance(obj, Post):
+            changes['terms'].update(words(obj.body))
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            history = db.inspect(obj).attrs.username.history
+            for username in history.deleted or ():
+                changes['users'][username] = False
+            for username in history.added or ():
+                changes['users'][username] = True
+        elif isinstance(obj, Post):
+            history = db.inspect(obj).attrs.body.history
+            for body in history.deleted or ():
+                changes['terms'].subtract(words(body))
+            for body in history.added or ():
+                changes['terms'].update(words(body))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes['users'][obj.username] = False
+        elif isinstance(obj, Post):
+            changes['terms'].subtract(words(obj.body))
+
+def after_commit(session):
+    changes = session.info.pop('suggest', None)
+    if changes and (changes['users'] or any(changes['terms'].values())):
+        try:
+            _apply(changes['users'], changes['terms'])
+        except redis.exceptions.RedisError:
+            pass
+
+def after_rollback(session):
+    session.info.pop('suggest', None)
+
+def _apply(users, terms):
+    r = current_app.redis
+    pipe = r.pipeline()
+    added = [_user_entry(name) for name, present in users.items() if present]
+    removed = [_user_entry(name) for name, present in users.items() if not present]
+    if removed:
+        pipe.zrem(USERS_KEY, *removed)
+    if added:
+        pipe.zadd(USERS_KEY, {entry: 0 for entry in added})
+    terms = {term: n for term, n in terms.items() if n}
+    for term, n in terms.items():
+        pipe.zincrby(TERM_COUNTS_KEY, n, term)
+    results = pipe.execute()
+    counts = results[len(results) - len(terms):]
+
+    # Only words used often enough are offered, which keeps the lexical
+    # set small and leaves out typos
+    threshold = current_app.config['SUGGEST_MIN_TERM_COUNT']
+    pipe = r.pipeline()
+    for term, count in zip(terms, counts):
+        if count >= threshold:
+            pipe.zadd(TERMS_KEY, {term: 0})
+        else:
+            pipe.zrem(TERMS_KEY, term)
+            if count <= 0:
+                pipe.zrem(TERM_COUNTS_KEY, term)
+    pipe.execute()
+
+def _prefix_range(key, prefix, limit):
+    prefix = prefix.encode()
+    return current_app.redis.zrangebylex(key, b'[' + prefix, b'[' + prefix + b'\xff', 0, limit)
+
+def suggest(query, limit=8):
+    """Usernames starting with query, and completions of its last word."""
+    query = query.strip().lstrip('@').lower()
+    result = {'users': [], 'terms': []}
+    if not query:
+        return result
+    entries = _prefix_range(USERS_KEY, query, limit)
+    result['users'] = [entry.decode().split('\x00', 1)[1] for entry in entries]
+    last = query.split()[-1]
+    candidates = [term.decode() for term in _prefix_range(TERMS_KEY, last, limit * 4)]
+    if candidates:
+        counts = current_app.redis.zmscore(TERM_COUNTS_KEY, candidates)
+        ranked = sorted(zip(candidates, counts), key=lambda item: -(item[1] or 0))
+        result['terms'] = [term for term, count in ranked[:limit] if term != last]
+    return result
+
+def rebuild():
+    """Recreate the index from the users and posts tables."""
+    from apps.user.models import User
+    from apps.blog.models import Post
+    r = current_app.redis
+    r.delete(USERS_KEY, TERMS_KEY, TERM_COUNTS_KEY)
+    batch = current_app.config['SEARCH_REINDEX_BATCH_SIZE']
+    for usernames in db.session.scalars(
+            db.select(User.username).execution_options(yield_per=batch)).partitions():
+        r.zadd(USERS_KEY, {_user_entry(username): 0 for username in usernames})
+    terms = Counter()
+    for bodies in db.session.scalars(
+            db.select(Post.body).execution_options(yield_per=batch)).partitions():
+        for body in bodies:
+            terms.update(words(body))
+    _apply({}, terms)
+    return r.zcard(USERS_KEY), r.zcard(TERMS_KEY)
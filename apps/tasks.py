@@ -1,66 +1,229 @@
 import sys
 import os
 import time
+import gzip
 import json
 from flask import render_template
+from flask_babel import force_locale
+from flask_mail import Message
 from rq import get_current_job
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import create_app
+from apps.worker import create_worker_app
 from apps.extensions import db
 from apps.user.models import User, Task, Notification
 from apps.blog.models import Post
 from apps.user.utils import send_email
+from apps.core.models import Subscriber
+from apps.mailer import deliver
+from apps.search import bulk_index, record_index_lag, defer, replay, schedule_replay, REPLAY_KEY
+from apps.search_client import SearchUnavailable
+from apps import language
 
-app = create_app()
+app = create_worker_app()
 app.app_context().push()
 
-def _set_task_progress(progress):
-    job = get_current_job()
-    if job:
-        job.meta['progress'] = progress
-        job.save_meta()
-        task = Task.query.get(job.get_id())
+# Filled in per recipient after the newsletter is rendered once per locale
+UNSUBSCRIBE_PLACEHOLDER = '%%unsubscribe_url%%'
+
+# Last reported (time, progress) per job running in this process
+_last_progress = {}
+
+def _set_task_progress(progress, task_id=None, user_id=None):
+    # Progress belongs to the current job unless reported for another task,
+    # as newsletter chunks do for their campaign
+    if task_id is None:
+        job = get_current_job()
+        if not job:
+            return
+        task_id, user_id = job.get_id(), job.meta.get('user_id')
+    # Intermediate progress only goes to Redis, and only when enough time
+    # has passed or it moved far enough; the database is written once
+    last_time, last_progress = _last_progress.get(task_id, (0, None))
+    now = time.monotonic()
+    if progress < 100 and last_progress is not None and \
+            now - last_time < app.config['TASK_PROGRESS_INTERVAL'] and \
+            progress - last_progress < app.config['TASK_PROGRESS_STEP']:
+        return
+    _last_progress[task_id] = (now, progress)
+    Task.set_progress(task_id, progress, user_id)
+    if progress >= 100:
+        _last_progress.pop(task_id, None)
+        task = db.session.get(Task, task_id)
         if task:
             task.user.add_notification('task_progress', {
-                'task_id': job.get_id(),
+                'task_id': task_id,
                 'progress': progress
             })
-            if progress >= 100:
-                task.complete = True
+            task.complete = True
             db.session.commit()
 
-def export_posts(user_id):
+def _remove_expired_exports():
+    cutoff = time.time() - app.config['EXPORT_TTL']
+    with os.scandir(app.config['EXPORT_DIR']) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+
+def export_posts(user_id, export_id, download_url):
+    path = os.path.join(app.config['EXPORT_DIR'], f'{export_id}.ndjson.gz')
     try:
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         _set_task_progress(0)
-        
-        data = []
+        os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+        _remove_expired_exports()
+
+        # Posts are streamed from the database in batches and written one
+        # JSON document per line, so memory stays flat regardless of size
+        total_posts = max(user.post_count or 0, 1)
         i = 0
-        total_posts = user.posts.count()
-        
-        for post in user.posts.order_by(Post.timestamp.asc()):
-            data.append({
-                'body': post.body,
-                'timestamp': post.timestamp.isoformat() + 'Z',
-                'language': post.language if post.language else 'en'
-            })
-            time.sleep(2)  # Simulate work
-            i += 1
-            _set_task_progress(100 * i // total_posts)
-        
+        query = db.select(Post).where(Post.user_id == user.id) \
+            .order_by(Post.timestamp.asc(), Post.id.asc()) \
+            .execution_options(yield_per=app.config['EXPORT_BATCH_SIZE'])
+        with gzip.open(path + '.part', 'wt', encoding='utf-8') as f:
+            for posts in db.session.scalars(query).partitions():
+                for post in posts:
+                    f.write(json.dumps({
+                        'body': post.body,
+                        'timestamp': post.timestamp.isoformat() + 'Z',
+                        'language': post.language if post.language else 'en'
+                    }) + '\n')
+                i += len(posts)
+                _set_task_progress(min(99, 100 * i // total_posts))
+        os.replace(path + '.part', path)
+
+        if os.path.getsize(path) <= app.config['EXPORT_ATTACHMENT_LIMIT']:
+            with open(path, 'rb') as f:
+                attachments = [('posts.ndjson.gz', 'application/gzip', f.read())]
+            os.remove(path)
+            download_url = None
+        else:
+            attachments = None
         send_email(
             subject='[Portfolio] Your Blog Posts Export',
             sender=app.config['ADMINS'][0],
             recipients=[user.email],
-            text_body=render_template('email/export_posts.txt', user=user),
-            html_body=render_template('email/export_posts.html', user=user),
-            attachments=[('posts.json', 'application/json', json.dumps({'posts': data}, indent=4))],
+            text_body=render_template('email/export_posts.txt', user=user,
+                                      download_url=download_url),
+            html_body=render_template('email/export_posts.html', user=user,
+                                      download_url=download_url),
+            attachments=attachments,
             sync=True
         )
-        
+
+    except Exception as e:
+        app.logger.error('Unhandled exception', exc_info=e)
+        # Nothing links to a half-written export
+        try:
+            os.remove(path + '.part')
+        except FileNotFoundError:
+            pass
+    finally:
+        _set_task_progress(100)
+
+def _newsletter_key(task_id):
+    return f'newsletter:{task_id}'
+
+def send_newsletter(user_id, subject, body, unsubscribe_url):
+    task_id = get_current_job().get_id()
+    key = _newsletter_key(task_id)
+    try:
+        _set_task_progress(0)
+
+        # The body is the same for everyone who reads a language, so each
+        # locale is rendered once and only the unsubscribe link is filled in
+        rendered = {}
+        for locale in app.config['LANGUAGES']:
+            with force_locale(locale):
+                rendered[locale] = tuple(
+                    render_template(f'email/newsletter.{ext}', body=body,
+                                    unsubscribe_url=UNSUBSCRIBE_PLACEHOLDER)
+                    for ext in ('txt', 'html'))
+
+        estimate = db.session.scalar(
+            db.select(db.func.count(Subscriber.id)).where(Subscriber.confirmed))
+        app.redis.hset(key, 'estimate', estimate)
+        app.redis.expire(key, app.config['TASK_PROGRESS_TTL'])
+
+        # Recipients are streamed in chunks, each one a job of its own so
+        # that every worker process can pick chunks up in parallel
+        query = db.select(Subscriber.id, Subscriber.email, Subscriber.locale) \
+            .where(Subscriber.confirmed) \
+            .order_by(Subscriber.id) \
+            .execution_options(yield_per=app.config['NEWSLETTER_CHUNK_SIZE'])
+        total = 0
+        for rows in db.session.execute(query).partitions():
+            app.task_queue.enqueue('apps.tasks.send_newsletter_chunk', task_id, user_id,
+                                   subject, rendered, unsubscribe_url,
+                                   [tuple(row) for row in rows], meta={'user_id': user_id})
+            total += len(rows)
+
+        pipe = app.redis.pipeline()
+        pipe.hset(key, 'total', total)
+        pipe.hget(key, 'done')
+        _, done = pipe.execute()
+        _newsletter_progress(task_id, user_id, int(done or 0), total)
+    except Exception as e:
+        app.logger.error('Unhandled exception', exc_info=e)
+        _set_task_progress(100)
+
+def send_newsletter_chunk(task_id, user_id, subject, rendered, unsubscribe_url, recipients):
+    key = _newsletter_key(task_id)
+    try:
+        # One SMTP connection for the whole chunk
+        deliver(app, _newsletter_messages(subject, rendered, unsubscribe_url, recipients))
     except Exception as e:
         app.logger.error('Unhandled exception', exc_info=e)
     finally:
-        _set_task_progress(100)
\ No newline at end of file
+        pipe = app.redis.pipeline()
+        pipe.hincrby(key, 'done', len(recipients))
+        pipe.hget(key, 'total')
+        pipe.hget(key, 'estimate')
+        done, total, estimate = pipe.execute()
+        _newsletter_progress(task_id, user_id, done,
+                             None if total is None else int(total), int(estimate or 0))
+
+def _newsletter_messages(subject, rendered, unsubscribe_url, recipients):
+    default = rendered[app.config['LANGUAGES'][0]]
+    messages = []
+    for id, email, locale in recipients:
+        text_body, html_body = rendered.get(locale, default)
+        url = f'{unsubscribe_url}?token={Subscriber.get_unsubscribe_token(id)}'
+        messages.append(Message(subject, sender=app.config['ADMINS'][0], recipients=[email],
+                                body=text_body.replace(UNSUBSCRIBE_PLACEHOLDER, url),
+                                html=html_body.replace(UNSUBSCRIBE_PLACEHOLDER, url)))
+    return messages
+
+def _newsletter_progress(task_id, user_id, done, total, estimate=0):
+    # total is unknown until every chunk has been queued
+    if total is not None and done >= total:
+        # Several jobs can see the last chunk finish; only one completes the task
+        if app.redis.hsetnx(_newsletter_key(task_id), 'finished', 1):
+            _set_task_progress(100, task_id, user_id)
+    else:
+        _set_task_progress(min(99, 100 * done // max(total or estimate, 1)),
+                           task_id, user_id)
+
+def index_documents(changes, queued_at):
+    try:
+        failed = bulk_index(changes)
+    except SearchUnavailable:
+        # Retrying into an open breaker would only use up the retries
+        defer(changes)
+        return
+    if failed:
+        # Raising lets RQ retry the job, which re-reads every document
+        raise RuntimeError(f'{failed} of {len(changes)} search index updates failed')
+    record_index_lag(len(changes), time.time() - queued_at)
+
+def replay_index_changes():
+    app.redis.delete(f'{REPLAY_KEY}:scheduled')
+    count = replay()
+    if app.redis.llen(REPLAY_KEY):
+        # Still down: try again when the breaker closes next
+        schedule_replay()
+    app.logger.info(f'Replayed {count} search index changes')
+
+def detect_languages(ids):
+    language.detect_languages(ids)
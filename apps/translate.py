@@ -1,29 +1,164 @@
-import json
-import requests
+import os
+import threading
 import uuid
+from hashlib import sha256
+import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
 from flask_babel import _
+from apps.extensions import db
+from apps import cache
+from apps.core.models import Translation
 
-def translate(text, source_language, dest_language):
-    if 'MS_TRANSLATOR_KEY' not in current_app.config or \
-            not current_app.config['MS_TRANSLATOR_KEY']:
-        return _('Error: the translation service is not configured.')
-    
+# Limits of a single Translator request
+MAX_TEXTS = 1000
+MAX_CHARACTERS = 50000
+
+_http = None
+_http_pid = None
+_http_lock = threading.Lock()
+
+def _session():
+    # Keep-alive connections are reused across clicks; a forked process
+    # must not share the sockets of its parent, so each pid gets its own
+    global _http, _http_pid
+    with _http_lock:
+        if _http_pid != os.getpid():
+            size = current_app.config['TRANSLATOR_POOL_SIZE']
+            _http = requests.Session()
+            _http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=size))
+            _http.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=size))
+            _http_pid = os.getpid()
+        return _http
+
+def _key(text, source_language, dest_language):
+    return sha256(text.encode()).hexdigest(), source_language or '', dest_language
+
+def _cached(keys):
+    """{key: translation} for the keys in the caches or the database."""
+    names = {':'.join(key): key for key in keys}
+    found = {names[name]: text
+             for name, text in cache.get_many('translation', list(names)).items()}
+    missing = {}
+    for key in keys:
+        if key not in found:
+            missing.setdefault(key[1:], []).append(key[0])
+    # One query per language pair for whatever the caches did not have
+    stored = {}
+    for (source_language, dest_language), hashes in missing.items():
+        for text_hash, text in db.session.execute(
+                db.select(Translation.text_hash, Translation.text).filter(
+                    Translation.text_hash.in_(hashes),
+                    Translation.source_language == source_language,
+                    Translation.dest_language == dest_language)):
+            stored[(text_hash, source_language, dest_language)] = text
+    if stored:
+        _cache(stored)
+        found.update(stored)
+    return found
+
+def _cache(translations):
+    cache.set_many('translation', {':'.join(key): text for key, text in translations.items()},
+                   current_app.config['TRANSLATION_CACHE_TTL'])
+
+def _store(translations):
+    # A session of its own, so translating never commits the caller's work
+    rows = [Translation(text_hash=text_hash, source_language=source_language,
+                        dest_language=dest_language, text=text)
+            for (text_hash, source_language, dest_language), text in translations.items()]
+    with db.orm.Session(db.engine) as session:
+        session.add_all(rows)
+        try:
+            session.commit()
+        except db.exc.IntegrityError:
+            # Some were translated by another request in the meantime, so
+            # insert the rows one by one and skip those
+            session.rollback()
+            for row in rows:
+                session.add(row)
+                try:
+                    session.commit()
+                except db.exc.IntegrityError:
+                    session.rollback()
+    _cache(translations)
+
+def _request(texts, source_language, dest_language):
+    """Translate texts in one call; None if the service failed."""
     auth = {
         'Ocp-Apim-Subscription-Key': current_app.config['MS_TRANSLATOR_KEY'],
         'Ocp-Apim-Subscription-Region': current_app.config.get('MS_TRANSLATOR_REGION', 'eastus'),
         'Content-type': 'application/json',
         'X-ClientTraceId': str(uuid.uuid4())
     }
-    
-    r = requests.post(
-        'https://api.cognitive.microsofttranslator.com'
-        '/translate?api-version=3.0&from={}&to={}'.format(
-            source_language, dest_language), 
-        headers=auth, 
-        json=[{'Text': text}])
-    
+    params = {'api-version': '3.0', 'to': dest_language}
+    if source_language:
+        params['from'] = source_language
+    try:
+        r = _session().post(
+            current_app.config['MS_TRANSLATOR_URL'].rstrip('/') + '/translate',
+            params=params, headers=auth, json=[{'Text': text} for text in texts],
+            timeout=(current_app.config['TRANSLATOR_CONNECT_TIMEOUT'],
+                     current_app.config['TRANSLATOR_READ_TIMEOUT']))
+    except requests.RequestException as e:
+        current_app.logger.warning(f'Translation request failed: {e}')
+        return None
     if r.status_code != 200:
-        return _('Error: the translation service failed.')
-    
-    return r.json()[0]['translations'][0]['text']
\ No newline at end of file
+        return None
+    try:
+        translations = [item['translations'][0]['text'] for item in r.json()]
+    except (ValueError, KeyError, IndexError, TypeError):
+        translations = None
+    if translations is None or len(translations) != len(texts):
+        current_app.logger.warning('Translation service sent a malformed response')
+        return None
+    return translations
+
+def _chunks(items):
+    # (key, text) items split to fit the request limits
+    chunk, size = [], 0
+    for key, text in items:
+        if chunk and (len(chunk) == MAX_TEXTS or size + len(text) > MAX_CHARACTERS):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((key, text))
+        size += len(text)
+    if chunk:
+        yield chunk
+
+def translate_batch(texts, dest_language):
+    """Translate {id: (text, source_language)} into dest_language.
+
+    Texts translated before come from the caches or the database, the rest
+    is sent with one request per source language. Returns {id: translation},
+    with an error message for the texts that could not be translated.
+    """
+    if 'MS_TRANSLATOR_KEY' not in current_app.config or \
+            not current_app.config['MS_TRANSLATOR_KEY']:
+        error = _('Error: the translation service is not configured.')
+        return {id: error for id in texts}
+
+    keys = {id: _key(text, source_language, dest_language)
+            for id, (text, source_language) in texts.items()}
+    found = _cached(set(keys.values()))
+    pending = {}
+    for id, (text, source_language) in texts.items():
+        if keys[id] not in found:
+            pending.setdefault(keys[id][1], {})[keys[id]] = text
+
+    translated = {}
+    for source_language, group in pending.items():
+        for chunk in _chunks(group.items()):
+            translations = _request([text for key, text in chunk], source_language, dest_language)
+            if translations is not None:
+                translated.update(zip([key for key, text in chunk], translations))
+    if translated:
+        _store(translated)
+        found.update(translated)
+    result = {id: found.get(key) for id, key in keys.items()}
+    if None in result.values():
+        error = _('Error: the translation service failed.')
+        result = {id: error if text is None else text for id, text in result.items()}
+    return result
+
+def translate(text, source_language, dest_language):
+    return translate_batch({0: (text, source_language)}, dest_language)[0]
@@ -0,0 +1,83 @@
+import time
+from datetime import datetime, timedelta
+import redis
+from flask import current_app
+from apps.extensions import db
+from apps import cache
+
+BUFFER_KEY = 'last-seen'
+FLUSHING_KEY = 'last-seen:flushing'
+FLUSH_LOCK_KEY = 'last-seen:flush'
+
+# When this process last buffered each user, and last attempted a flush
+_buffered = {}
+_next_flush = 0
+
+def touch(user):
+    """Record that user is active without a write transaction per request.
+
+    Timestamps are buffered in a Redis hash and written to the database in
+    bulk. Both the skip window and the flush period are half of
+    LAST_SEEN_INTERVAL, so stored values are never older than the interval.
+    """
+    period = current_app.config['LAST_SEEN_INTERVAL'] / 2
+    now = datetime.utcnow()
+    recent = now - timedelta(seconds=period)
+    if (user.last_seen and user.last_seen > recent) or \
+            _buffered.get(user.id, datetime.min) > recent:
+        return
+    try:
+        current_app.redis.hset(BUFFER_KEY, str(user.id), now.isoformat())
+    except redis.exceptions.RedisError:
+        user.last_seen = now
+        db.session.commit()
+        return
+    _buffered[user.id] = now
+
+def flush_if_due():
+    # Called on authenticated requests; at most one process flushes per period
+    global _next_flush
+    if time.monotonic() >= _next_flush:
+        period = current_app.config['LAST_SEEN_INTERVAL'] / 2
+        _next_flush = time.monotonic() + period
+        # Entries older than the period no longer skip anything
+        recent = datetime.utcnow() - timedelta(seconds=period)
+        for id in [id for id, at in _buffered.items() if at <= recent]:
+            del _buffered[id]
+        flush(lock=True)
+
+def flush(lock=False):
+    """Write all buffered last_seen values with one bulk UPDATE.
+
+    The buffer is moved aside while it is written and only deleted once the
+    UPDATE is committed. A failed flush leaves it to the next one, which
+    writes it before taking anything buffered since.
+    """
+    from apps.user.models import User
+    period = current_app.config['LAST_SEEN_INTERVAL'] / 2
+    try:
+        if lock and not current_app.redis.set(FLUSH_LOCK_KEY, 1, nx=True,
+                                              ex=max(int(period), 1)):
+            return 0
+        try:
+            current_app.redis.renamenx(BUFFER_KEY, FLUSHING_KEY)
+        except redis.exceptions.ResponseError:
+            # nothing buffered
+            pass
+        buffered = current_app.redis.hgetall(FLUSHING_KEY)
+    except redis.exceptions.RedisError:
+        return 0
+    if not buffered:
+        return 0
+    db.session.execute(db.update(User), [
+        {'id': int(id), 'last_seen': datetime.fromisoformat(value.decode())}
+        for id, value in buffered.items()
+    ])
+    db.session.commit()
+    try:
+        current_app.redis.delete(FLUSHING_KEY)
+    except redis.exceptions.RedisError:
+        # written again by the next flush, which does no harm
+        pass
+    cache.invalidate('user', *[id.decode() for id in buffered])
+    return len(buffered)
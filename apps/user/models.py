@@ -6,11 +6,16 @@ import os
 import redis
 import rq
 from datetime import datetime, timedelta
-from hashlib import md5
-from flask import current_app, url_for
+from hashlib import md5, sha256
+from flask import current_app, request, url_for
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.security import generate_password_hash, check_password_hash
 from apps.extensions import db
+from apps import cache
+
+def avatar_url(digest, size):
+    return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
 
 # Association table for followers
 followers = db.Table(
@@ -19,12 +24,26 @@ followers = db.Table(
     db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
 )
 
+# Materialized home timeline: one row per (reader, post), filled at write time
+timeline = db.Table(
+    'timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('timestamp', db.DateTime),
+    db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp')
+)
+
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
     
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(64), index=True, unique=True)
+    # The old name is loaded on rename, so caches and the type-ahead index
+    # can drop it even when the attribute had expired
+    username = db.column_property(db.Column(db.String(64), index=True, unique=True),
+                                  active_history=True)
     email = db.Column(db.String(120), index=True, unique=True)
+    # md5 of the email, kept so listings get avatars without hashing per post
+    avatar_hash = db.Column(db.String(32))
     password_hash = db.Column(db.String(128))
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
@@ -33,6 +52,7 @@ class User(UserMixin, db.Model):
     messages_sent = db.relationship('Message', foreign_keys='Message.sender_id', backref='author', lazy='dynamic')
     messages_received = db.relationship('Message', foreign_keys='Message.recipient_id', backref='recipient', lazy='dynamic')
     last_message_read_time = db.Column(db.DateTime)
+    unread_message_count = db.Column(db.Integer, default=0, server_default='0')
     
     # Notifications
     notifications = db.relationship('Notification', backref='user', lazy='dynamic')
@@ -53,21 +73,93 @@ class User(UserMixin, db.Model):
     
     # Posts
     posts = db.relationship('Post', backref='author', lazy='dynamic')
+
+    # Denormalized counters, kept current by follow/unfollow and the Post listeners
+    post_count = db.Column(db.Integer, default=0, server_default='0')
+    follower_count = db.Column(db.Integer, index=True, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, default=0, server_default='0')
     
+    # Columns kept out of the shared user cache; they load on first access
+    _uncached = ('password_hash', 'token')
+
+    def _cache_row(self):
+        row = {}
+        for column in User.__table__.columns:
+            if column.key in User._uncached:
+                continue
+            value = getattr(self, column.key)
+            row[column.key] = value.isoformat() if isinstance(value, datetime) else value
+        return row
+
+    @staticmethod
+    def _from_cache_row(row):
+        row = dict(row)
+        for column in User.__table__.columns:
+            if isinstance(column.type, db.DateTime) and row.get(column.key):
+                row[column.key] = datetime.fromisoformat(row[column.key])
+        user = User(**row)
+        make_transient_to_detached(user)
+        # load=False attaches the cached state to the session without a SELECT
+        return db.session.merge(user, load=False)
+
+    def _cache(self):
+        ttl = current_app.config['USER_CACHE_TTL']
+        cache.set('user', str(self.id), self._cache_row(), ttl)
+        cache.set('username', self.username, self.id, ttl)
+
+    @staticmethod
+    def get_cached(id):
+        # Never overwrite an instance this session already holds
+        user = db.session.identity_map.get(db.session.identity_key(User, id))
+        if user is not None:
+            return user
+        row = cache.get('user', str(id))
+        if row is not None:
+            return User._from_cache_row(row)
+        user = db.session.get(User, id)
+        if user is not None:
+            user._cache()
+        return user
+
+    @staticmethod
+    def get_by_username(username):
+        id = cache.get('username', username)
+        if id is not None:
+            return User.get_cached(id)
+        user = User.query.filter_by(username=username).first()
+        if user is not None:
+            user._cache()
+        return user
+
+    @staticmethod
+    def after_flush(session, flush_context):
+        # Drop cached rows of every user changed in this flush, including the
+        # username they were cached under before a rename
+        for user in list(session.dirty) + list(session.deleted):
+            if isinstance(user, User):
+                history = db.inspect(user).attrs.username.history
+                names = [user.username] + list(history.deleted or [])
+                cache.invalidate_on_commit('user', str(user.id))
+                cache.invalidate_on_commit('username', *[n for n in names if n])
+
     def new_messages(self):
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        return Message.query.filter_by(recipient=self).filter(
-            Message.timestamp > last_read_time).count()
+        return self.unread_message_count or 0
     
     def add_notification(self, name, data):
+        from apps.user import stream
         self.notifications.filter_by(name=name).delete()
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
+        n = Notification(name=name, payload_json=json.dumps(data), user=self,
+                         timestamp=time())
         db.session.add(n)
+        stream.publish_on_commit(self.id, name, data, n.timestamp)
         return n
     
     # Task methods
     def launch_task(self, name, description, *args, **kwargs):
-        rq_job = current_app.task_queue.enqueue(f'apps.tasks.{name}', self.id, *args, **kwargs)
+        rq_job = current_app.task_queue.enqueue(f'apps.tasks.{name}', self.id, *args,
+                                                meta={'user_id': self.id}, **kwargs)
+        current_app.redis.set(Task.progress_key(rq_job.get_id()), 0,
+                              ex=current_app.config['TASK_PROGRESS_TTL'])
         task = Task(id=rq_job.get_id(), name=name, description=description, user=self)
         db.session.add(task)
         return task
@@ -83,6 +175,8 @@ class User(UserMixin, db.Model):
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        if self.token:
+            cache.invalidate_on_commit('token', User._token_key(self.token))
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
@@ -90,24 +184,42 @@ class User(UserMixin, db.Model):
     
     def revoke_token(self):
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
+        if self.token:
+            cache.invalidate_on_commit('token', User._token_key(self.token))
     
+    @staticmethod
+    def _token_key(token):
+        # Cache by digest so raw tokens are never written to Redis
+        return sha256(token.encode('utf-8')).hexdigest()
+
     @staticmethod
     def check_token(token):
-        user = User.query.filter_by(token=token).first()
-        if user is None or user.token_expiration < datetime.utcnow():
+        key = User._token_key(token)
+        entry = cache.get('token', key)
+        if entry is None:
+            user = User.query.filter_by(token=token).first()
+            if user is None:
+                return None
+            entry = [user.id, user.token_expiration.timestamp()]
+            ttl = min(entry[1] - datetime.utcnow().timestamp(),
+                      current_app.config['TOKEN_CACHE_TTL'])
+            if ttl > 0:
+                cache.set('token', key, entry, ttl)
+        user_id, expiration = entry
+        if expiration < datetime.utcnow().timestamp():
             return None
-        return user
+        return User.get_cached(user_id)
     
     # API Resource representation
-    def to_dict(self, include_email=False):
+    def to_dict(self, include_email=False, url_for=url_for):
         data = {
             'id': self.id,
             'username': self.username,
             'last_seen': self.last_seen.isoformat() + 'Z',
             'about_me': self.about_me,
-            'post_count': self.posts.count(),
-            'follower_count': self.followers.count(),
-            'followed_count': self.followed.count(),
+            'post_count': self.post_count,
+            'follower_count': self.follower_count,
+            'followed_count': self.followed_count,
             '_links': {
                 'self': url_for('api.get_user', id=self.id),
                 'followers': url_for('api.get_followers', id=self.id),
@@ -118,6 +230,15 @@ class User(UserMixin, db.Model):
         if include_email:
             data['email'] = self.email
         return data
+
+    @staticmethod
+    def to_dict_batch(users):
+        # The counters are stored columns, so a page serializes without any
+        # per-user queries; links are built from one URL adapter for the page
+        adapter = current_app.create_url_adapter(request)
+        def build(endpoint, **values):
+            return adapter.build(endpoint, values)
+        return [user.to_dict(url_for=build) for user in users]
     
     def from_dict(self, data, new_user=False):
         for field in ['username', 'email', 'about_me']:
@@ -129,24 +250,130 @@ class User(UserMixin, db.Model):
     # Follow methods
     def follow(self, user):
         if not self.is_following(user):
+            popular = user.is_popular()
             self.followed.append(user)
+            self._count_follow(user, 1)
+            if not popular:
+                self._backfill_timeline(user)
 
     def unfollow(self, user):
         if self.is_following(user):
+            demoted = user.is_popular() and \
+                user.follower_count - 1 <= current_app.config['TIMELINE_FANOUT_LIMIT']
             self.followed.remove(user)
+            self._count_follow(user, -1)
+            self._prune_timeline(user)
+            if demoted:
+                User._fan_out_posts(user.id)
+
+    def _count_follow(self, user, step):
+        # Atomic increments, so concurrent follows never lose a count. The
+        # ORM UPDATE moves the loaded counters along too, so they can be read
+        # before the next flush
+        db.session.execute(db.update(User).where(User.id == self.id).values(
+            followed_count=User.followed_count + step))
+        db.session.execute(db.update(User).where(User.id == user.id).values(
+            follower_count=User.follower_count + step))
+        # Neither row goes through the flush hooks
+        cache.invalidate_on_commit('user', str(self.id), str(user.id))
 
     def is_following(self, user):
         return self.followed.filter(followers.c.followed_id == user.id).count() > 0
 
+    def is_popular(self):
+        # Popular authors are not fanned out on write, readers pull their posts
+        return (self.follower_count or 0) > current_app.config['TIMELINE_FANOUT_LIMIT']
+
+    @staticmethod
+    def popular_ids():
+        limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+        return db.select(User.id).where(User.follower_count > limit)
+
+    @staticmethod
+    def recount():
+        from apps.blog.models import Post
+        popular = set(db.session.scalars(User.popular_ids()))
+        db.session.execute(db.update(User).values(
+            post_count=db.select(db.func.count(Post.id)).where(
+                Post.user_id == User.id).scalar_subquery(),
+            follower_count=db.select(db.func.count()).select_from(followers).where(
+                followers.c.followed_id == User.id).scalar_subquery(),
+            followed_count=db.select(db.func.count()).select_from(followers).where(
+                followers.c.follower_id == User.id).scalar_subquery(),
+            unread_message_count=db.select(db.func.count(Message.id)).where(
+                Message.recipient_id == User.id,
+                db.or_(User.last_message_read_time.is_(None),
+                       Message.timestamp > User.last_message_read_time)).scalar_subquery()
+        ))
+        for id in popular.difference(db.session.scalars(User.popular_ids())):
+            User._fan_out_posts(id)
+        # The bulk update bypasses the flush hooks, so drop the cached rows
+        # of every user once it is committed
+        ids = [str(id) for id in db.session.scalars(db.select(User.id))]
+        for i in range(0, len(ids), 1000):
+            cache.invalidate_on_commit('user', *ids[i:i + 1000])
+
     def followed_posts(self):
         from apps.blog.models import Post
-        followed = Post.query.join(followers, (followers.c.followed_id == Post.user_id)).filter(followers.c.follower_id == self.id)
-        own = Post.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(Post.timestamp.desc())
+        queries = [query for query, timestamp, id in self.followed_posts_branches()]
+        return queries[0].union(*queries[1:]).order_by(Post.timestamp.desc())
+
+    def followed_posts_branches(self):
+        """The two halves of followed_posts() as (query, timestamp, id)
+        branches for keyset_paginate, the timeline seeking on its own index."""
+        from apps.blog.models import Post
+        materialized = Post.query.join(timeline, timeline.c.post_id == Post.id).filter(
+            timeline.c.user_id == self.id)
+        pulled = Post.query.join(followers, (followers.c.followed_id == Post.user_id)).filter(
+            followers.c.follower_id == self.id, Post.user_id.in_(User.popular_ids()))
+        return [(materialized, timeline.c.timestamp, timeline.c.post_id),
+                (pulled, Post.timestamp, Post.id)]
+
+    def _backfill_timeline(self, user):
+        from apps.blog.models import Post
+        posts = db.select(db.literal(self.id), Post.id, Post.timestamp).where(
+            Post.user_id == user.id,
+            ~db.exists().where(timeline.c.user_id == self.id, timeline.c.post_id == Post.id))
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'], posts))
+
+    @staticmethod
+    def _fan_out_posts(user_id):
+        # An author back under the fan-out limit is no longer pulled on read,
+        # so the posts written while popular go into the followers' timelines
+        from apps.blog.models import Post
+        posts = db.select(followers.c.follower_id, Post.id, Post.timestamp).join(
+            followers, followers.c.followed_id == Post.user_id).where(
+            Post.user_id == user_id,
+            ~db.exists().where(timeline.c.user_id == followers.c.follower_id,
+                               timeline.c.post_id == Post.id))
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'], posts))
+
+    def _prune_timeline(self, user):
+        from apps.blog.models import Post
+        db.session.execute(timeline.delete().where(
+            timeline.c.user_id == self.id,
+            timeline.c.post_id.in_(db.select(Post.id).where(Post.user_id == user.id))))
+
+    def rebuild_timeline(self):
+        from apps.blog.models import Post
+        db.session.execute(timeline.delete().where(timeline.c.user_id == self.id))
+        own = db.select(db.literal(self.id), Post.id, Post.timestamp).where(
+            Post.user_id == self.id)
+        followed = db.select(db.literal(self.id), Post.id, Post.timestamp).join(
+            followers, followers.c.followed_id == Post.user_id).where(
+            followers.c.follower_id == self.id, Post.user_id.not_in(User.popular_ids()))
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'], own.union(followed)))
+
+    @db.validates('email')
+    def _set_avatar_hash(self, key, email):
+        self.avatar_hash = md5(email.lower().encode('utf-8')).hexdigest() if email else None
+        return email
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return avatar_url(self.avatar_hash, size)
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -166,6 +393,22 @@ class User(UserMixin, db.Model):
             return
         return User.query.get(id)
 
+    def is_admin(self):
+        return self.email in current_app.config['ADMINS']
+
+    def get_export_token(self, export_id):
+        return jwt.encode({'export': export_id, 'user': self.id,
+                           'exp': time() + current_app.config['EXPORT_TTL']},
+                          current_app.config['SECRET_KEY'], algorithm='HS256')
+
+    @staticmethod
+    def verify_export_token(token):
+        try:
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+            return data['user'], data['export']
+        except (jwt.InvalidTokenError, KeyError):
+            return
+
     def __repr__(self):
         return f"<User {self.username}>"
 
@@ -203,17 +446,44 @@ class Task(db.Model):
             return None
         return rq_job
     
+    # Progress lives only in Redis while a task runs; a missing key means the
+    # task finished or its state expired, as with a missing RQ job before
+    @staticmethod
+    def progress_key(id):
+        return f'task-progress:{id}'
+
     def get_progress(self):
-        job = self.get_rq_job()
-        return job.meta.get('progress', 0) if job is not None else 100
+        return Task.get_progress_many([self])[0]
+
+    @staticmethod
+    def get_progress_many(tasks):
+        # One MGET for all the tasks instead of a job fetch per task
+        if not tasks:
+            return []
+        try:
+            values = current_app.redis.mget([Task.progress_key(task.id) for task in tasks])
+        except redis.exceptions.RedisError:
+            values = [None] * len(tasks)
+        return [int(value) if value is not None else 100 for value in values]
+
+    @staticmethod
+    def set_progress(id, progress, user_id):
+        from apps.user import stream
+        current_app.redis.set(Task.progress_key(id), progress,
+                              ex=current_app.config['TASK_PROGRESS_TTL'])
+        stream.publish(user_id, 'task_progress', {'task_id': id, 'progress': progress}, time())
 
 # Mixin for API collections
 class PaginatedAPIMixin(object):
     @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
+    def to_dict_batch(items):
+        return [item.to_dict() for item in items]
+
+    @classmethod
+    def to_collection_dict(cls, query, page, per_page, endpoint, **kwargs):
         resources = query.paginate(page=page, per_page=per_page, error_out=False)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': cls.to_dict_batch(resources.items),
             '_meta': {
                 'page': page,
                 'per_page': per_page,
@@ -1,15 +1,22 @@
 #apps/user/routes.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, abort, Response, send_file
 from flask_login import current_user, login_user, logout_user, login_required
 from urllib.parse import urlparse as url_parse
 from datetime import datetime
+import os
+import time
+import uuid
+import redis
 from flask_babel import _
 
 from apps.extensions import db, login
 from apps.user.forms import LoginForm, RegistrationForm, EditProfileForm, EmptyForm, ResetPasswordRequestForm, ResetPasswordForm, MessageForm
 from apps.user.utils import send_password_reset_email
-from apps.user.models import User, Message, Notification
+from apps.user.models import User, Message, Notification, Task
+from apps.user import stream
 from apps.blog.models import Post
+from apps.blog import rows
+from apps.pagination import paginate_listing
 
 user_bp = Blueprint(
     'user',
@@ -19,13 +26,7 @@ user_bp = Blueprint(
 
 @login.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-@user_bp.before_request
-def update_last_seen():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+    return User.get_cached(int(user_id))
 
 @user_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -101,26 +102,20 @@ def edit_profile():
 @user_bp.route('/<username>', methods=['GET'])
 @login_required
 def profile(username):
-    u = User.query.filter_by(username=username).first_or_404()
+    u = User.get_by_username(username) or abort(404)
     form = EmptyForm()
     
     # Add pagination to user profile posts
-    page = request.args.get('page', 1, type=int)
-    posts = u.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page,
+    posts, next_url, prev_url = paginate_listing(
+        rows.project(u.posts.order_by(Post.timestamp.desc())), Post, 'user.profile',
         per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False
+        username=u.username
     )
     
-    next_url = url_for('user.profile', username=u.username, page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for('user.profile', username=u.username, page=posts.prev_num) \
-        if posts.has_prev else None
-    
     return render_template(
         'user.html',
         user=u,
-        posts=posts.items,
+        posts=rows.load(posts),
         next_url=next_url,
         prev_url=prev_url,
         form=form
@@ -131,7 +126,7 @@ def profile(username):
 def follow(username):
     form = EmptyForm()
     if form.validate_on_submit():
-        target = User.query.filter_by(username=username).first()
+        target = User.get_by_username(username)
         if not target:
             flash(f'User {username} not found.')
             return redirect(url_for('core.index'))
@@ -150,7 +145,7 @@ def follow(username):
 def unfollow(username):
     form = EmptyForm()
     if form.validate_on_submit():
-        target = User.query.filter_by(username=username).first()
+        target = User.get_by_username(username)
         if not target:
             flash(f'User {username} not found.')
             return redirect(url_for('core.index'))
@@ -196,18 +191,20 @@ def reset_password(token):
 @user_bp.route('/user/<username>/popup')
 @login_required
 def user_popup(username):
-    user = User.query.filter_by(username=username).first_or_404()
+    user = User.get_by_username(username) or abort(404)
     return render_template('user_popup.html', user=user)
 
 @user_bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
 @login_required
 def send_message(recipient):
-    user = User.query.filter_by(username=recipient).first_or_404()
+    user = User.get_by_username(recipient) or abort(404)
     form = MessageForm()
     if form.validate_on_submit():
         msg = Message(author=current_user, recipient=user,
                       body=form.message.data)
         db.session.add(msg)
+        user.unread_message_count = User.unread_message_count + 1
+        db.session.flush()
         user.add_notification('unread_message_count', user.new_messages())
         db.session.commit()
         flash(_('Your message has been sent.'))
@@ -219,17 +216,14 @@ def send_message(recipient):
 @login_required
 def messages():
     current_user.last_message_read_time = datetime.utcnow()
+    current_user.unread_message_count = 0
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
 
-    page = request.args.get('page', 1, type=int)
-    messages = current_user.messages_received.order_by(
-        Message.timestamp.desc()).paginate(page=page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('user.messages', page=messages.next_num) \
-        if messages.has_next else None
-    prev_url = url_for('user.messages', page=messages.prev_num) \
-        if messages.has_prev else None
-    return render_template('messages.html', messages=messages.items,
+    messages, next_url, prev_url = paginate_listing(
+        current_user.messages_received.order_by(Message.timestamp.desc()),
+        Message, 'user.messages', per_page=current_app.config['POSTS_PER_PAGE'])
+    return render_template('messages.html', messages=messages,
                            next_url=next_url, prev_url=prev_url)
 
 @user_bp.route('/notifications')
@@ -238,12 +232,38 @@ def notifications():
     since = request.args.get('since', 0.0, type=float)
     notifications = current_user.notifications.filter(
         Notification.timestamp > since).order_by(Notification.timestamp.asc())
-    return jsonify([{
+    # In-flight progress is only kept in Redis; report it without moving since
+    tasks = current_user.get_tasks_in_progress()
+    progress = [{
+        'name': 'task_progress',
+        'data': {'task_id': task.id, 'progress': p},
+        'timestamp': since
+    } for task, p in zip(tasks, Task.get_progress_many(tasks))]
+    return jsonify(progress + [{
         'name': n.name,
         'data': n.get_data(),
         'timestamp': n.timestamp
     } for n in notifications])
 
+@user_bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    # 503 makes EventSource give up so the page falls back to polling
+    try:
+        current_app.redis.ping()
+    except redis.exceptions.RedisError:
+        return '', 503
+    tasks = current_user.get_tasks_in_progress()
+    initial = [{'name': 'unread_message_count', 'data': current_user.new_messages(),
+                'timestamp': time.time()}]
+    initial += [{'name': 'task_progress', 'data': {'task_id': task.id, 'progress': progress},
+                 'timestamp': time.time()}
+                for task, progress in zip(tasks, Task.get_progress_many(tasks))]
+    return Response(
+        stream.events(current_app._get_current_object(), current_user.id, initial),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Export Route 
 
 @user_bp.route('/export_posts')
@@ -252,6 +272,22 @@ def export_posts():
     if current_user.get_task_in_progress('export_posts'):
         flash(_('An export task is currently in progress'))
     else:
-        current_user.launch_task('export_posts', _('Exporting posts...'))
+        export_id = uuid.uuid4().hex
+        download_url = url_for('user.download_export', _external=True,
+                               token=current_user.get_export_token(export_id))
+        current_user.launch_task('export_posts', _('Exporting posts...'),
+                                 export_id, download_url)
         db.session.commit()
-    return redirect(url_for('user.profile', username=current_user.username))
\ No newline at end of file
+    return redirect(url_for('user.profile', username=current_user.username))
+
+@user_bp.route('/export_posts/<token>')
+@login_required
+def download_export(token):
+    export = User.verify_export_token(token)
+    if export is None or export[0] != current_user.id:
+        abort(404)
+    path = os.path.join(current_app.config['EXPORT_DIR'], f'{export[1]}.ndjson.gz')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='application/gzip', as_attachment=True,
+                     download_name='posts.ndjson.gz')
\ No newline at end of file
@@ -0,0 +1,96 @@
+import json
+import os
+import queue
+import threading
+import time
+import redis
+from flask import current_app
+from apps.extensions import db
+
+CHANNEL_PREFIX = 'notifications:'
+HEARTBEAT = 15
+
+def publish(user_id, name, data, timestamp):
+    try:
+        current_app.redis.publish(f'{CHANNEL_PREFIX}{user_id}', json.dumps({
+            'name': name, 'data': data, 'timestamp': timestamp}))
+    except redis.exceptions.RedisError:
+        pass
+
+def publish_on_commit(user_id, name, data, timestamp):
+    db.session.info.setdefault('notifications', []).append((user_id, name, data, timestamp))
+
+def after_commit(session):
+    for notification in session.info.pop('notifications', []):
+        publish(*notification)
+
+def after_rollback(session):
+    session.info.pop('notifications', None)
+
+class Broker(object):
+    """Fans one pattern subscription per process out to the open streams.
+
+    Every connected client only costs a queue, not a Redis connection, so a
+    process running an async worker class can hold thousands of idle streams.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def subscribe(self, app, user_id):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, args=(app,), daemon=True).start()
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            self._queues.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._queues.get(user_id, set())
+            queues.discard(q)
+            if not queues:
+                self._queues.pop(user_id, None)
+
+    def _run(self, app):
+        delay = 1
+        while True:
+            try:
+                pubsub = app.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+                delay = 1
+                for message in pubsub.listen():
+                    user_id = int(message['channel'].decode()[len(CHANNEL_PREFIX):])
+                    with self._lock:
+                        queues = list(self._queues.get(user_id, ()))
+                    for q in queues:
+                        try:
+                            q.put_nowait(message['data'].decode())
+                        except queue.Full:
+                            pass
+            except (redis.exceptions.RedisError, ValueError):
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+broker = Broker()
+
+def events(app, user_id, initial=()):
+    """Server-Sent Events for one client, starting with a state snapshot."""
+    q = broker.subscribe(app, user_id)
+    try:
+        yield 'retry: 5000\n\n'
+        for event in initial:
+            yield f'data: {json.dumps(event)}\n\n'
+        while True:
+            try:
+                data = q.get(timeout=HEARTBEAT)
+            except queue.Empty:
+                # comments keep proxies from timing out and detect gone clients
+                yield ': keep-alive\n\n'
+                continue
+            yield f'data: {data}\n\n'
+    finally:
+        broker.unsubscribe(user_id, q)
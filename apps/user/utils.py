@@ -1,17 +1,17 @@
-from threading import Thread
 from flask import current_app, render_template
 from flask_mail import Message
 from apps.extensions import mail
+from apps.mailer import mailer
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
-def send_email(subject, sender, recipients, text_body, html_body):
+def send_email(subject, sender, recipients, text_body, html_body,
+               attachments=None, sync=False):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
+    if attachments:
+        for attachment in attachments:
+            msg.attach(*attachment)
+    mailer.send(msg, sync=sync)
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
@@ -23,6 +23,14 @@ def send_password_reset_email(user):
                html_body=render_template('email/reset_password.html',
                                          user=user, token=token))
 
+def send_subscribe_confirmation_email(subscriber):
+    token = subscriber.get_confirm_token()
+    send_email('[Microblog] Confirm Your Subscription',
+               sender=current_app.config['ADMINS'][0],
+               recipients=[subscriber.email],
+               text_body=render_template('email/confirm_subscription.txt', token=token),
+               html_body=render_template('email/confirm_subscription.html', token=token))
+
 def send_welcome_email(user):
     msg = Message(
         subject="Welcome to the Microblog!",
@@ -0,0 +1,53 @@
+"""RQ worker entry point.
+
+Run with ``python -m apps.worker``. The app and apps.tasks are loaded once
+in this process, so the work-horse forked for every job starts with them
+already imported instead of building the web app again.
+"""
+import os
+import sys
+from flask import Flask
+import redis
+import rq
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, basedir)
+
+from config.settings import Config
+from apps.extensions import db, mail, babel
+from apps.admin.logging import setup_logging
+from apps.events import register_event_handlers
+from apps.search_client import create_client
+
+def create_worker_app(config_class=Config):
+    # Only what tasks use: the database, mail, Redis, search, the templates
+    # and translations for them; no blueprints, login or CLI commands
+    app = Flask('app', root_path=basedir)
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    mail.init_app(app)
+    babel.init_app(app)
+
+    app.redis = redis.from_url(app.config['REDIS_URL'])
+    app.task_queue = rq.Queue('portfolio-tasks', connection=app.redis)
+
+    app.elasticsearch = create_client(app)
+
+    setup_logging(app)
+    register_event_handlers()
+    return app
+
+def main():
+    from apps.tasks import app
+
+    # Pooled connections must not be shared with the forked work-horses
+    engine = db.engine
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+    # The scheduler is needed for jobs retried after an interval
+    worker = rq.Worker([app.task_queue], connection=app.redis)
+    worker.work(with_scheduler=True)
+
+if __name__ == '__main__':
+    main()
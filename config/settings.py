@@ -24,6 +24,20 @@ class Config:
     # Pagination
     POSTS_PER_PAGE = config("POSTS_PER_PAGE", default=5, cast=int)
 
+    # Timeline: authors with more followers than this are pulled on read
+    TIMELINE_FANOUT_LIMIT = config("TIMELINE_FANOUT_LIMIT", default=1000, cast=int)
+
+    # Caching: in-process LRU in front of Redis
+    LOCAL_CACHE_SIZE = config("LOCAL_CACHE_SIZE", default=4096, cast=int)
+    LOCAL_CACHE_TTL = config("LOCAL_CACHE_TTL", default=30, cast=int)
+    # Rendered post fragments, invalidated when the post or its author changes
+    FRAGMENT_CACHE_TTL = config("FRAGMENT_CACHE_TTL", default=86400, cast=int)
+    TOKEN_CACHE_TTL = config("TOKEN_CACHE_TTL", default=300, cast=int)
+    USER_CACHE_TTL = config("USER_CACHE_TTL", default=300, cast=int)
+
+    # Seconds a displayed last_seen may lag behind real activity
+    LAST_SEEN_INTERVAL = config("LAST_SEEN_INTERVAL", default=60, cast=int)
+
     # Languages
     LANGUAGES = ['en', 'es']
 
@@ -35,12 +49,73 @@ class Config:
     MAIL_PASSWORD = config("MAIL_PASSWORD", default=None)
     ADMINS = config("ADMINS", default="admin@example.com").split(",")
 
+    # Mail delivery: WORKERS threads per process each send up to BATCH_SIZE
+    # queued messages per SMTP connection
+    MAIL_WORKERS = config("MAIL_WORKERS", default=2, cast=int)
+    MAIL_QUEUE_SIZE = config("MAIL_QUEUE_SIZE", default=1000, cast=int)
+    MAIL_BATCH_SIZE = config("MAIL_BATCH_SIZE", default=50, cast=int)
+    MAIL_RETRIES = config("MAIL_RETRIES", default=3, cast=int)
+    MAIL_RETRY_DELAY = config("MAIL_RETRY_DELAY", default=1.0, cast=float)
+
+    # Newsletter recipients per job; each chunk is sent over one connection
+    NEWSLETTER_CHUNK_SIZE = config("NEWSLETTER_CHUNK_SIZE", default=500, cast=int)
+    # Lifetime of the link that confirms a subscription, and of the
+    # unsubscribe link in every newsletter
+    SUBSCRIBE_CONFIRM_TTL = config("SUBSCRIBE_CONFIRM_TTL", default=2 * 86400, cast=int)
+    UNSUBSCRIBE_TOKEN_TTL = config("UNSUBSCRIBE_TOKEN_TTL", default=90 * 86400, cast=int)
+
     # Search
-    ELASTICSEARCH_URL = None
+    ELASTICSEARCH_URL = config("ELASTICSEARCH_URL", default=None)
+    SEARCH_INDEX_RETRIES = config("SEARCH_INDEX_RETRIES", default=5, cast=int)
+    SEARCH_REPLICAS = config("SEARCH_REPLICAS", default=1, cast=int)
+    SEARCH_CACHE_TTL = config("SEARCH_CACHE_TTL", default=300, cast=int)
+    # Seconds a search may take, and a bulk index request from the worker
+    SEARCH_TIMEOUT = config("SEARCH_TIMEOUT", default=2.0, cast=float)
+    SEARCH_INDEX_TIMEOUT = config("SEARCH_INDEX_TIMEOUT", default=30.0, cast=float)
+    # After THRESHOLD failures in a row Elasticsearch is left alone for RESET
+    # seconds: searches use the database and index changes are queued
+    SEARCH_BREAKER_THRESHOLD = config("SEARCH_BREAKER_THRESHOLD", default=5, cast=int)
+    SEARCH_BREAKER_RESET = config("SEARCH_BREAKER_RESET", default=30, cast=int)
+    SUGGEST_MIN_TERM_COUNT = config("SUGGEST_MIN_TERM_COUNT", default=3, cast=int)
+    # Reindexing: WORKERS processes each stream an id range of PARTITION_SIZE
+    SEARCH_REINDEX_WORKERS = config("SEARCH_REINDEX_WORKERS", default=4, cast=int)
+    SEARCH_REINDEX_PARTITION_SIZE = config("SEARCH_REINDEX_PARTITION_SIZE", default=10000, cast=int)
+    SEARCH_REINDEX_BATCH_SIZE = config("SEARCH_REINDEX_BATCH_SIZE", default=500, cast=int)
 
     # Translation
     MS_TRANSLATOR_KEY = config("MS_TRANSLATOR_KEY", default=None)
     MS_TRANSLATOR_REGION = config("MS_TRANSLATOR_REGION", default="eastus")
+    MS_TRANSLATOR_URL = config("MS_TRANSLATOR_URL", default="https://api.cognitive.microsofttranslator.com")
+    # Connect and read timeouts, and keep-alive connections per process
+    TRANSLATOR_CONNECT_TIMEOUT = config("TRANSLATOR_CONNECT_TIMEOUT", default=3.05, cast=float)
+    TRANSLATOR_READ_TIMEOUT = config("TRANSLATOR_READ_TIMEOUT", default=10.0, cast=float)
+    TRANSLATOR_POOL_SIZE = config("TRANSLATOR_POOL_SIZE", default=10, cast=int)
+    # Posts translated by one /translate/batch request
+    TRANSLATE_BATCH_LIMIT = config("TRANSLATE_BATCH_LIMIT", default=100, cast=int)
+    # Translations are stored in the database; Redis keeps the recent ones
+    TRANSLATION_CACHE_TTL = config("TRANSLATION_CACHE_TTL", default=7 * 86400, cast=int)
+    # Language detection; the backfill runs WORKERS processes over id ranges
+    LANGUAGE_CACHE_TTL = config("LANGUAGE_CACHE_TTL", default=86400, cast=int)
+    LANGUAGE_BACKFILL_WORKERS = config("LANGUAGE_BACKFILL_WORKERS", default=4, cast=int)
+    LANGUAGE_BACKFILL_CHUNK_SIZE = config("LANGUAGE_BACKFILL_CHUNK_SIZE", default=1000, cast=int)
 
     # Background Jobs (Redis)
-    REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
\ No newline at end of file
+    REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
+
+    # Task progress: report at most every INTERVAL seconds unless it moved STEP percent
+    TASK_PROGRESS_INTERVAL = config("TASK_PROGRESS_INTERVAL", default=1.0, cast=float)
+    TASK_PROGRESS_STEP = config("TASK_PROGRESS_STEP", default=5, cast=int)
+    TASK_PROGRESS_TTL = 86400
+
+    # Post exports: attached to the email when small, otherwise kept in
+    # EXPORT_DIR for EXPORT_TTL seconds behind a signed download link
+    EXPORT_DIR = config("EXPORT_DIR", default=os.path.join(basedir, 'exports'))
+    EXPORT_BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=500, cast=int)
+    EXPORT_ATTACHMENT_LIMIT = config("EXPORT_ATTACHMENT_LIMIT", default=5 * 1024 * 1024, cast=int)
+    EXPORT_TTL = config("EXPORT_TTL", default=7 * 86400, cast=int)
+
+class TestConfig(Config):
+    # Tests run on their own in-memory database, never on DATABASE_URL
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    ELASTICSEARCH_URL = None
@@ -0,0 +1,45 @@
+"""add materialized home timeline
+
+Revision ID: 3f1c2a7d9b10
+Revises: 94a05f136c6c
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = '94a05f136c6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    # backfill every user's own posts and the posts of the users they follow
+    op.execute(
+        'INSERT INTO timeline (user_id, post_id, timestamp) '
+        'SELECT user_id, id, timestamp FROM post '
+        'UNION '
+        'SELECT followers.follower_id, post.id, post.timestamp FROM followers '
+        'JOIN post ON post.user_id = followers.followed_id'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp')
+
+    op.drop_table('timeline')
@@ -0,0 +1,35 @@
+"""add newsletter subscriber table
+
+Revision ID: 5d9e2b7f41c3
+Revises: b27d5e0c9a41
+Create Date: 2026-10-18 23:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9e2b7f41c3'
+down_revision = 'b27d5e0c9a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('subscriber',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('locale', sa.String(length=5), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('subscriber', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_subscriber_email'), ['email'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('subscriber', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_subscriber_email'))
+
+    op.drop_table('subscriber')
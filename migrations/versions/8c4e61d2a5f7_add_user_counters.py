@@ -0,0 +1,46 @@
+"""add denormalized user counters
+
+Revision ID: 8c4e61d2a5f7
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 20:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e61d2a5f7'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=True))
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=True))
+        batch_op.add_column(sa.Column('followed_count', sa.Integer(), server_default='0', nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_follower_count'), ['follower_count'], unique=False)
+
+    # populate the counters from the existing rows
+    user = sa.table('user', sa.column('id'), sa.column('post_count'),
+                    sa.column('follower_count'), sa.column('followed_count'))
+    post = sa.table('post', sa.column('user_id'))
+    followers = sa.table('followers', sa.column('follower_id'), sa.column('followed_id'))
+    op.execute(user.update().values(
+        post_count=sa.select(sa.func.count()).select_from(post).where(
+            post.c.user_id == user.c.id).scalar_subquery(),
+        follower_count=sa.select(sa.func.count()).select_from(followers).where(
+            followers.c.followed_id == user.c.id).scalar_subquery(),
+        followed_count=sa.select(sa.func.count()).select_from(followers).where(
+            followers.c.follower_id == user.c.id).scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_follower_count'))
+        batch_op.drop_column('followed_count')
+        batch_op.drop_column('follower_count')
+        batch_op.drop_column('post_count')
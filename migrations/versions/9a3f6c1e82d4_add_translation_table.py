@@ -0,0 +1,33 @@
+"""add translation table
+
+Revision ID: 9a3f6c1e82d4
+Revises: e41a7c3b9d28
+Create Date: 2026-10-19 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3f6c1e82d4'
+down_revision = 'e41a7c3b9d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('translation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('text_hash', sa.String(length=64), nullable=False),
+    sa.Column('source_language', sa.String(length=5), nullable=False),
+    sa.Column('dest_language', sa.String(length=5), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('text_hash', 'source_language', 'dest_language')
+    )
+
+
+def downgrade():
+    op.drop_table('translation')
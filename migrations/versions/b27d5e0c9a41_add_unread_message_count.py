@@ -0,0 +1,38 @@
+"""add unread message counter
+
+Revision ID: b27d5e0c9a41
+Revises: 8c4e61d2a5f7
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b27d5e0c9a41'
+down_revision = '8c4e61d2a5f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_message_count', sa.Integer(), server_default='0', nullable=True))
+
+    # count the messages received since each user last opened the inbox
+    user = sa.table('user', sa.column('id'), sa.column('last_message_read_time'),
+                    sa.column('unread_message_count'))
+    message = sa.table('message', sa.column('recipient_id'), sa.column('timestamp'))
+    op.execute(user.update().values(
+        unread_message_count=sa.select(sa.func.count()).select_from(message).where(
+            message.c.recipient_id == user.c.id,
+            sa.or_(user.c.last_message_read_time.is_(None),
+                   message.c.timestamp > user.c.last_message_read_time)
+        ).scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('unread_message_count')
@@ -0,0 +1,38 @@
+"""add user avatar hash
+
+Revision ID: c6d0b8e5a217
+Revises: 9a3f6c1e82d4
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+from hashlib import md5
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6d0b8e5a217'
+down_revision = '9a3f6c1e82d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('avatar_hash', sa.String(length=32), nullable=True))
+
+    # md5 is not portable SQL, so hash the existing emails here
+    user = sa.table('user', sa.column('id'), sa.column('email'), sa.column('avatar_hash'))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(user.c.id, user.c.email).where(
+        user.c.email.is_not(None))).all()
+    if rows:
+        connection.execute(user.update().where(user.c.id == sa.bindparam('user_id')).values(
+            avatar_hash=sa.bindparam('digest')), [
+            {'user_id': id, 'digest': md5(email.lower().encode('utf-8')).hexdigest()}
+            for id, email in rows])
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('avatar_hash')
@@ -0,0 +1,31 @@
+"""add FTS5 search table for posts
+
+Revision ID: e41a7c3b9d28
+Revises: 5d9e2b7f41c3
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a7c3b9d28'
+down_revision = '5d9e2b7f41c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # only SQLite has FTS5; other databases keep using Elasticsearch or LIKE
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(body, "
+               "tokenize='unicode61 remove_diacritics 2')")
+    op.execute('INSERT INTO post_fts (rowid, body) SELECT id, body FROM post')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TABLE IF EXISTS post_fts')
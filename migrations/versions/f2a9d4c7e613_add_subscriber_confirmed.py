@@ -0,0 +1,32 @@
+"""add subscriber confirmed flag
+
+Revision ID: f2a9d4c7e613
+Revises: c6d0b8e5a217
+Create Date: 2026-10-19 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9d4c7e613'
+down_revision = 'c6d0b8e5a217'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('subscriber', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('confirmed', sa.Boolean(), server_default=sa.false(),
+                                      nullable=False))
+
+    # Addresses that subscribed before the confirmation mail keep receiving
+    # the newsletter
+    subscriber = sa.table('subscriber', sa.column('confirmed'))
+    op.execute(subscriber.update().values(confirmed=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subscriber', schema=None) as batch_op:
+        batch_op.drop_column('confirmed')
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Measure sustained newsletter throughput against a local SMTP sink
+
+Starts an aiosmtpd server that accepts and discards every message, then
+sends newsletter chunks from several processes the way RQ workers do,
+one SMTP connection per chunk. Run from the project root:
+python support/bench_newsletter.py [--messages N] [--workers N] [--chunk N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+class Sink:
+    async def handle_DATA(self, server, session, envelope):
+        return '250 OK'
+
+def send_chunks(args):
+    port, chunks, chunk_size = args
+    from flask import render_template
+    from apps.tasks import app, UNSUBSCRIBE_PLACEHOLDER, _newsletter_messages
+    from apps.mailer import deliver
+    state = app.extensions['mail']
+    state.server, state.port, state.use_tls, state.suppress = '127.0.0.1', port, False, False
+    rendered = {locale: tuple(
+        render_template(f'email/newsletter.{ext}', body='\n\n'.join(['Lorem ipsum dolor sit amet ' * 20] * 4),
+                        unsubscribe_url=UNSUBSCRIBE_PLACEHOLDER)
+        for ext in ('txt', 'html')) for locale in app.config['LANGUAGES']}
+    sent = 0
+    for first in chunks:
+        recipients = [(id, f'user{id}@example.com', 'en')
+                      for id in range(first, first + chunk_size)]
+        sent += deliver(app, _newsletter_messages('Benchmark', rendered,
+                                                  'http://localhost/unsubscribe', recipients))
+    return sent
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk', type=int, default=500)
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    from aiosmtpd.controller import Controller
+    controller = Controller(Sink(), hostname='127.0.0.1', port=args.port)
+    controller.start()
+    try:
+        chunks = list(range(0, args.messages, args.chunk))
+        work = [(args.port, chunks[i::args.workers], args.chunk) for i in range(args.workers)]
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.workers) as pool:
+            sent = sum(pool.map(send_chunks, work))
+        elapsed = time.perf_counter() - start
+    finally:
+        controller.stop()
+    print(f'{sent} messages in {elapsed:.1f} s with {args.workers} workers: '
+          f'{sent / elapsed * 60:,.0f} messages per minute')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Measure RQ worker bootstrap and per-job overhead
+
+Compares the old bootstrap (apps.tasks importing the web app and building
+it again) with the worker app preloaded in the parent process. Run from
+the project root: python support/bench_worker.py [--jobs N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOTSTRAP = {
+    'web app': 'from app import create_app\n'
+               'create_app().app_context().push()',
+    'worker app': 'from apps.worker import create_worker_app\n'
+                  'create_worker_app().app_context().push()',
+}
+
+JOB = 'from apps.extensions import db\n' \
+      'db.session.execute(db.text("SELECT 1"))\n' \
+      'db.session.remove()'
+
+def time_to_first_job(code, runs):
+    # A fresh interpreter per run, like a worker starting up
+    script = f'import time\nt = time.perf_counter()\n{code}\n{JOB}\n' \
+             f'print(time.perf_counter() - t)'
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True,
+                             capture_output=True, text=True).stdout
+        results.append(float(out.split()[-1]))
+    return min(results)
+
+def per_job(code, jobs, preload):
+    # Fork a work-horse per job the way RQ does; without preloading each
+    # child has to bootstrap before it can run the job
+    if preload:
+        exec(code, {})
+        from apps.extensions import db
+        engine = db.engine
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+    start = time.perf_counter()
+    for _ in range(jobs):
+        pid = os.fork()
+        if pid == 0:
+            if not preload:
+                exec(code, {})
+            exec(JOB, {})
+            os._exit(0)
+        os.waitpid(pid, 0)
+    return (time.perf_counter() - start) / jobs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    for name, code in BOOTSTRAP.items():
+        print(f'{name:>10}: time to first job {time_to_first_job(code, args.runs) * 1000:8.1f} ms')
+
+    # Each measurement runs in its own process so preloading one does not
+    # warm up the other
+    for name, code, preload in (('web app', BOOTSTRAP['web app'], False),
+                                ('worker app', BOOTSTRAP['worker app'], True)):
+        pid = os.fork()
+        if pid == 0:
+            label = f'{name}, {"preloaded" if preload else "per job"}'
+            print(f'{label:>22}: {per_job(code, args.jobs, preload) * 1000:8.1f} ms per job')
+            sys.stdout.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import unittest
+
+from app import create_app
+from config.settings import TestConfig
+from apps.extensions import db
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test in an app context, on an empty in-memory database.
+
+    The app is built once per class from `config`; subclasses that need
+    other settings point it at a TestConfig subclass.
+    """
+    config = TestConfig
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app(cls.config)
+
+    def setUp(self):
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
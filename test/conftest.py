@@ -4,13 +4,14 @@ import sys, os
 # 1) ensure project root is on PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-# 2) import your real Flask app and unified db
-from app import app as flask_app
-from apps.db import db
+# 2) build a test app with its own in-memory database
+from app import create_app
+from config.settings import TestConfig
+from apps.extensions import db
 
 @pytest.fixture(scope="session")
 def app():
-    return flask_app
+    return create_app(TestConfig)
 
 @pytest.fixture(scope="session")
 def app_context(app):
@@ -0,0 +1,105 @@
+import json
+import time
+import unittest
+
+import fakeredis
+
+from apps.extensions import db
+from apps import cache
+from apps.user.models import User
+from test.base import AppTestCase
+
+class CacheCase(AppTestCase):
+    def setUp(self):
+        # a Redis of its own for every test, and nothing left in the local caches
+        self.app.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        for name in ('user', 'username', 'token'):
+            cache.local_cache(name).clear()
+        super().setUp()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        self.id = self.user.id
+
+    def reload(self):
+        # a new request: nothing in the identity map, so reads go to the caches
+        db.session.remove()
+        return User.get_cached(self.id)
+
+    def test_token_cache(self):
+        token = self.user.get_token()
+        db.session.commit()
+        self.assertEqual(User.check_token(token).id, self.id)
+        self.assertEqual(self.reload().id, self.id)
+        self.assertEqual(User.check_token(token).id, self.id)
+        self.assertEqual(len(self.app.redis.keys('token:*')), 1)
+
+        user = self.reload()
+        user.revoke_token()
+        db.session.commit()
+        self.assertEqual(self.app.redis.keys('token:*'), [])
+        self.assertIsNone(User.check_token(token))
+
+        user = self.reload()
+        new_token = user.get_token()
+        db.session.commit()
+        self.assertNotEqual(new_token, token)
+        self.assertIsNone(User.check_token(token))
+        self.assertEqual(User.check_token(new_token).id, self.id)
+
+    def test_user_cache(self):
+        user = self.reload()
+        self.assertIsNotNone(self.app.redis.get(f'user:{self.id}'))
+        self.assertEqual(User.get_by_username('john').id, self.id)
+
+        # served from the cache, changed and committed
+        user = self.reload()
+        user.username = 'johnny'
+        user.about_me = 'hello'
+        db.session.commit()
+        self.assertIsNone(self.app.redis.get(f'user:{self.id}'))
+        self.assertIsNone(self.app.redis.get('username:john'))
+        self.assertIsNone(cache.local_cache('user').get(str(self.id)))
+
+        user = self.reload()
+        self.assertEqual((user.username, user.about_me), ('johnny', 'hello'))
+        self.assertIsNone(User.get_by_username('john'))
+        self.assertEqual(User.get_by_username('johnny').id, self.id)
+
+        # renamed while expired by the commit, the old name is dropped too
+        db.session.commit()
+        user.username = 'jack'
+        db.session.commit()
+        self.assertIsNone(self.app.redis.get('username:johnny'))
+        self.assertIsNone(User.get_by_username('johnny'))
+
+    def test_recount(self):
+        self.reload().post_count = 42
+        db.session.commit()
+        self.assertEqual(self.reload().post_count, 42)
+
+        User.recount()
+        db.session.commit()
+        self.assertIsNone(self.app.redis.get(f'user:{self.id}'))
+        self.assertEqual(self.reload().post_count, 0)
+
+    def test_invalidation_from_other_processes(self):
+        # Start a listener on this test's Redis and wait for it to subscribe
+        cache._listener_pid = None
+        cache.get('user', 'none')
+        deadline = time.monotonic() + 5
+        while self.app.redis.pubsub_numsub(cache.INVALIDATION_CHANNEL)[0][1] == 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+        self.reload()
+        self.assertIsNotNone(cache.local_cache('user').get(str(self.id)))
+        # what invalidate() sends from another process
+        self.app.redis.publish(cache.INVALIDATION_CHANNEL, json.dumps(['user', [str(self.id)]]))
+        deadline = time.monotonic() + 5
+        while cache.local_cache('user').get(str(self.id)) is not None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
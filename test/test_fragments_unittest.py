@@ -0,0 +1,39 @@
+import unittest
+
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from apps import fragments
+from test.base import AppTestCase
+
+class FragmentsCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='john', email='john@example.com')
+        self.post = Post(body="hello", author=self.user)
+        db.session.add_all([self.user, self.post])
+        db.session.commit()
+        # ids repeat from test to test, unlike the process-wide caches
+        fragments.invalidate(self.post.id)
+
+    def render(self):
+        with self.app.test_request_context():
+            return str(fragments.render_posts([self.post]))
+
+    def test_render_posts(self):
+        html = self.render()
+        self.assertIn('john', html)
+        self.assertIn('hello', html)
+        self.assertEqual(self.render(), html)
+
+    def test_invalidated_by_changes(self):
+        self.render()
+        self.post.body = 'hello again'
+        db.session.commit()
+        self.assertIn('hello again', self.render())
+        self.user.username = 'johnny'
+        db.session.commit()
+        self.assertIn('johnny', self.render())
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
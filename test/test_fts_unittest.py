@@ -0,0 +1,35 @@
+import unittest
+
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from test.base import AppTestCase
+
+class FTSCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        u = User(username='john', email='john@example.com')
+        self.p1 = Post(body="the quick brown fox", author=u)
+        self.p2 = Post(body="quick quick quick", author=u)
+        self.p3 = Post(body="a lazy dog", author=u)
+        db.session.add_all([u, self.p1, self.p2, self.p3])
+        db.session.commit()
+
+    def test_search(self):
+        self.assertEqual(Post.search('quick', 1, 1), ([self.p2], 2))
+        self.assertEqual(Post.search('quick', 2, 1), ([self.p1], 2))
+        self.assertEqual(Post.search('cat', 1, 10), ([], 0))
+
+    def test_invalid_query(self):
+        self.assertEqual(Post.search('"quick" AND', 1, 10), ([], 0))
+
+    def test_index_follows_changes(self):
+        self.p3.body = 'an energetic dog'
+        db.session.delete(self.p2)
+        db.session.commit()
+        self.assertEqual(Post.search('lazy', 1, 10), ([], 0))
+        self.assertEqual(Post.search('energetic', 1, 10), ([self.p3], 1))
+        self.assertEqual(Post.search('quick', 1, 10), ([self.p1], 1))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,37 @@
+import unittest
+
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from apps import language
+from test.base import AppTestCase
+
+class LanguageCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        u = User(username='john', email='john@example.com')
+        self.posts = [
+            Post(body="this is a post written in plain english", author=u),
+            Post(body="esta es una publicación escrita en español", author=u),
+            Post(body="déjà traduit", author=u, language='fr')]
+        db.session.add_all([u] + self.posts)
+        db.session.commit()
+
+    def languages(self):
+        db.session.expire_all()
+        return [post.language for post in self.posts]
+
+    def test_detect_languages(self):
+        self.assertEqual(self.languages(), [None, None, 'fr'])
+        # posts that already have a language are left alone
+        self.assertEqual(language.detect_languages([post.id for post in self.posts]), 2)
+        self.assertEqual(self.languages(), ['en', 'es', 'fr'])
+        self.assertEqual(language.detect_languages([self.posts[0].id]), 0)
+
+    def test_backfill(self):
+        self.assertEqual(language.backfill(workers=1, size=1), 2)
+        self.assertEqual(self.languages(), ['en', 'es', 'fr'])
+        self.assertEqual(language.backfill(workers=1), 0)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
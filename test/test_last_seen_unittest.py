@@ -0,0 +1,53 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import fakeredis
+from sqlalchemy.exc import OperationalError
+
+from apps.extensions import db
+from apps.user import last_seen
+from apps.user.models import User
+from test.base import AppTestCase
+
+class LastSeenCase(AppTestCase):
+    def setUp(self):
+        self.app.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        last_seen._buffered.clear()
+        super().setUp()
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        self.users = [User(username=name, email=f'{name}@example.com', last_seen=yesterday)
+                      for name in ('john', 'susan')]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def seen(self, user):
+        db.session.expire_all()
+        return user.last_seen > datetime.utcnow() - timedelta(minutes=1)
+
+    def test_flush(self):
+        last_seen.touch(self.users[0])
+        self.assertFalse(self.seen(self.users[0]))
+        self.assertEqual(last_seen.flush(), 1)
+        self.assertTrue(self.seen(self.users[0]))
+        self.assertEqual(last_seen.flush(), 0)
+
+    def test_failed_flush_keeps_buffer(self):
+        john, susan = self.users
+        last_seen.touch(john)
+        error = OperationalError('UPDATE', {}, Exception('database is locked'))
+        with mock.patch.object(db.session, 'commit', side_effect=error):
+            with self.assertRaises(OperationalError):
+                last_seen.flush()
+        db.session.rollback()
+        self.assertFalse(self.seen(john))
+
+        # the failed batch is written first, then what was buffered since
+        last_seen.touch(susan)
+        self.assertEqual(last_seen.flush(), 1)
+        self.assertEqual((self.seen(john), self.seen(susan)), (True, False))
+        self.assertEqual(last_seen.flush(), 1)
+        self.assertTrue(self.seen(susan))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+import jwt
+
+from config.settings import TestConfig
+from apps.extensions import db
+from apps.core.models import Subscriber
+from test.base import AppTestCase
+
+class NewsletterConfig(TestConfig):
+    WTF_CSRF_ENABLED = False
+
+class NewsletterCase(AppTestCase):
+    config = NewsletterConfig
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+
+    def subscribe(self, email):
+        with mock.patch('apps.core.routes.send_subscribe_confirmation_email') as send:
+            self.client.post('/newsletter', data={'email': email})
+        return send
+
+    def test_double_opt_in(self):
+        send = self.subscribe('Susan@example.com')
+        subscriber = db.session.scalar(db.select(Subscriber))
+        self.assertEqual(subscriber.email, 'susan@example.com')
+        self.assertFalse(subscriber.confirmed)
+        send.assert_called_once_with(subscriber)
+
+        # a second request mails the link again, until it has been used
+        self.assertEqual(self.subscribe('susan@example.com').call_count, 1)
+        token = subscriber.get_confirm_token()
+        self.assertIsNone(Subscriber.verify_unsubscribe_token(token))
+        self.client.get('/newsletter/confirm', query_string={'token': token})
+        db.session.expire_all()
+        self.assertTrue(subscriber.confirmed)
+        self.assertEqual(self.subscribe('susan@example.com').call_count, 0)
+        self.assertEqual(db.session.scalar(db.select(db.func.count(Subscriber.id))), 1)
+
+    def test_unsubscribe_token(self):
+        subscriber = Subscriber(email='susan@example.com', confirmed=True)
+        db.session.add(subscriber)
+        db.session.commit()
+        expired = jwt.encode({'unsubscribe': subscriber.id, 'exp': 0},
+                             self.app.config['SECRET_KEY'], algorithm='HS256')
+        for token in (expired, 'garbage', subscriber.get_confirm_token()):
+            self.assertIsNone(Subscriber.verify_unsubscribe_token(token))
+
+        token = Subscriber.get_unsubscribe_token(subscriber.id)
+        self.client.get('/newsletter/unsubscribe', query_string={'token': token})
+        self.assertEqual(db.session.scalar(db.select(db.func.count(Subscriber.id))), 0)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
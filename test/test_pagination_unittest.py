@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timedelta
+
+from config.settings import TestConfig
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from apps.pagination import decode_cursor, encode_cursor, keyset_paginate
+from test.base import AppTestCase
+
+class PaginationCase(AppTestCase):
+    def walk(self, query, per_page):
+        # every page from the newest on, then back from the oldest
+        pages, cursor = [], None
+        while True:
+            items, cursor, prev_cursor = keyset_paginate(
+                query, Post, per_page, after=decode_cursor(cursor))
+            pages.append(items)
+            if cursor is None:
+                break
+        back = [pages[-1]]
+        while prev_cursor is not None:
+            items, next_cursor, prev_cursor = keyset_paginate(
+                query, Post, per_page, before=decode_cursor(prev_cursor))
+            back.append(items)
+        return pages, back[::-1]
+
+    def test_decode_cursor(self):
+        post = Post(id=7, timestamp=datetime(2024, 5, 1, 12, 30, 15, 250))
+        self.assertEqual(decode_cursor(encode_cursor(post)), (post.timestamp, 7))
+        for cursor in (None, '', 'garbage', '2024-05-01T12:30:15_x', 'yesterday_7'):
+            self.assertIsNone(decode_cursor(cursor))
+
+    def test_keyset_paginate(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        # pairs of posts share a timestamp, so pages split between them
+        posts = [Post(body=f'p{i}', author=u, timestamp=now + timedelta(seconds=i // 2))
+                 for i in range(7)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        newest = sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)
+
+        pages, back = self.walk(Post.query, 3)
+        self.assertEqual(pages, [newest[0:3], newest[3:6], newest[6:]])
+        self.assertEqual(back, pages)
+
+        items, next_cursor, prev_cursor = keyset_paginate(Post.query, Post, 10)
+        self.assertEqual((items, next_cursor, prev_cursor), (newest, None, None))
+
+    def test_keyset_paginate_branches(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2); u1.follow(u3)
+        db.session.commit()
+
+        now = datetime.utcnow()
+        posts = [Post(body=f'p{i}', author=(u2, u3)[i % 2], timestamp=now + timedelta(seconds=i // 3))
+                 for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        # later posts of a popular author are pulled, the earlier ones are in
+        # the timeline and pulled as well
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        try:
+            posts += [Post(body=f'p{i}', author=u2, timestamp=now + timedelta(seconds=i // 3))
+                      for i in range(5, 9)]
+            db.session.add_all(posts[5:])
+            db.session.commit()
+
+            expected = u1.followed_posts().order_by(Post.timestamp.desc(), Post.id.desc()).all()
+            self.assertEqual(len(expected), 9)
+            pages, back = self.walk(u1.followed_posts_branches(), 2)
+            self.assertEqual(sum(pages, []), expected)
+            self.assertEqual(back, pages)
+        finally:
+            self.app.config['TIMELINE_FANOUT_LIMIT'] = TestConfig.TIMELINE_FANOUT_LIMIT
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
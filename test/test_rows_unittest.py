@@ -0,0 +1,34 @@
+import unittest
+from datetime import datetime, timedelta
+
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from apps.blog import rows
+from test.base import AppTestCase
+
+class RowsCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(username='john', email='john@example.com')
+        self.u2 = User(username='susan', email='susan@example.com')
+        now = datetime.utcnow()
+        self.p1 = Post(body="post from john", author=self.u1, timestamp=now + timedelta(seconds=1))
+        self.p2 = Post(body="post from susan", author=self.u2, timestamp=now + timedelta(seconds=2))
+        db.session.add_all([self.u1, self.u2, self.p1, self.p2])
+        db.session.commit()
+
+    def test_project(self):
+        posts = rows.load(rows.project(Post.query.order_by(Post.timestamp.desc())).all())
+        self.assertEqual([(p.id, p.body, p.author.username) for p in posts],
+                         [(self.p2.id, self.p2.body, 'susan'), (self.p1.id, self.p1.body, 'john')])
+        self.assertEqual(posts[1].author.avatar(128), self.u1.avatar(128))
+
+    def test_by_id(self):
+        posts = rows.by_id([self.p1.id, 0, self.p2.id])
+        self.assertEqual([(p.id, p.author.username) for p in posts],
+                         [(self.p1.id, 'john'), (self.p2.id, 'susan')])
+        self.assertEqual(rows.by_id([]), [])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
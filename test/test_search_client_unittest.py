@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import fakeredis
+import redis
+
+from config.settings import TestConfig
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from apps.search_client import CircuitBreaker, SearchUnavailable, create_client
+from test.base import AppTestCase
+
+class FakeElasticsearch(BaseHTTPRequestHandler):
+    """Answers every request with an empty result, too late or with a 503."""
+    mode = 'ok'
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_request(self):
+        FakeElasticsearch.requests += 1
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.mode == 'slow':
+            # the client has given up by now
+            time.sleep(1)
+            return
+        status = 503 if self.mode == 'down' else 200
+        data = json.dumps({'errors': False, 'items': [],
+                           'hits': {'hits': [], 'total': {'value': 0}}}).encode()
+        self.send_response(status)
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_request
+
+class SearchClientCase(AppTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeElasticsearch)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        class SearchConfig(TestConfig):
+            ELASTICSEARCH_URL = f'http://127.0.0.1:{cls.server.server_port}'
+            SEARCH_TIMEOUT = 0.2
+            SEARCH_BREAKER_THRESHOLD = 2
+
+        cls.config = SearchConfig
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeElasticsearch.mode = 'ok'
+        FakeElasticsearch.requests = 0
+        try:
+            self.app.redis.delete('search-breaker:failures', 'search-breaker:open')
+        except redis.exceptions.RedisError:
+            pass
+        super().setUp()
+        # a new breaker for every test
+        self.app.elasticsearch = create_client(self.app)
+
+    def test_timeout(self):
+        FakeElasticsearch.mode = 'slow'
+        start = time.monotonic()
+        with self.assertRaises(SearchUnavailable):
+            self.app.elasticsearch.search(index='posts', query={'match_all': {}})
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_breaker_opens(self):
+        FakeElasticsearch.mode = 'down'
+        for _ in range(2):
+            with self.assertRaises(SearchUnavailable):
+                self.app.elasticsearch.search(index='posts', query={'match_all': {}})
+        self.assertFalse(self.app.elasticsearch.available)
+        with self.assertRaises(SearchUnavailable):
+            self.app.elasticsearch.search(index='posts', query={'match_all': {}})
+        self.assertEqual(FakeElasticsearch.requests, 2)
+
+    def test_breaker_shared_count(self):
+        # two processes, one Redis: a success anywhere ends the run of failures
+        r = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        web, worker = CircuitBreaker(r, threshold=2), CircuitBreaker(r, threshold=2)
+        web.failure()
+        worker.success()
+        web.failure()
+        self.assertTrue(web.allow())
+        worker.failure()
+        self.assertFalse(web.allow())
+
+    def test_search_falls_back_to_sql(self):
+        u = User(username='john', email='john@example.com')
+        p1 = Post(body="the quick brown fox", author=u)
+        p2 = Post(body="a lazy dog", author=u)
+        db.session.add_all([u, p1, p2])
+        db.session.commit()
+        self.assertEqual(Post.search('quick', 1, 10), ([], 0))
+
+        FakeElasticsearch.mode = 'down'
+        for _ in range(2):
+            self.assertEqual(Post.search('quick', 1, 10), ([p1], 1))
+        requests = FakeElasticsearch.requests
+        self.assertEqual(Post.search('lazy', 1, 10), ([p2], 1))
+        self.assertEqual(FakeElasticsearch.requests, requests)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,73 @@
+import json
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+import redis
+
+from config.settings import TestConfig
+from apps.extensions import db
+from apps.user.models import User
+from apps.blog.models import Post
+from test.base import AppTestCase
+
+class RecordingElasticsearch(BaseHTTPRequestHandler):
+    """Accepts every request and keeps the bulk request bodies."""
+    bulk = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.split('?')[0].endswith('/_bulk'):
+            RecordingElasticsearch.bulk.append(
+                [json.loads(line) for line in body.decode().splitlines() if line])
+        data = json.dumps({'errors': False, 'items': [],
+                           'hits': {'hits': [], 'total': {'value': 0}}}).encode()
+        self.send_response(200)
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_request
+
+class SearchIndexCase(AppTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingElasticsearch)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        class SearchConfig(TestConfig):
+            ELASTICSEARCH_URL = f'http://127.0.0.1:{cls.server.server_port}'
+
+        cls.config = SearchConfig
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        RecordingElasticsearch.bulk = []
+        super().setUp()
+
+    def test_index_inline_without_queue(self):
+        # with the queue unreachable the commit indexes the changes itself
+        with mock.patch.object(self.app.task_queue, 'enqueue',
+                               side_effect=redis.exceptions.ConnectionError):
+            u = User(username='john', email='john@example.com')
+            p = Post(body="the quick brown fox", author=u)
+            db.session.add_all([u, p])
+            db.session.commit()
+        self.assertEqual(len(RecordingElasticsearch.bulk), 1)
+        operations = RecordingElasticsearch.bulk[0]
+        action = operations.index({'index': {'_index': 'post', '_id': p.id}})
+        self.assertEqual(operations[action + 1]['body'], 'the quick brown fox')
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
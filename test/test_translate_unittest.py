@@ -0,0 +1,132 @@
+import json
+import threading
+import unittest
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from flask_login import login_user
+from werkzeug.exceptions import BadRequest
+
+from config.settings import TestConfig
+from apps.extensions import db
+from apps import cache
+from apps.blog.models import Post
+from apps.core.models import Translation
+from apps.core.routes import translate_posts
+from apps.translate import translate, translate_batch
+from apps.user.models import User
+from test.base import AppTestCase
+
+class StubTranslator(BaseHTTPRequestHandler):
+    """Translates by upper-casing, fails with a 500 or answers garbage."""
+    protocol_version = 'HTTP/1.1'
+    fail = False
+    malformed = False
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        texts = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubTranslator.requests.append((self.path, [item['Text'] for item in texts]))
+        status = 500 if self.fail else 200
+        data = json.dumps([{'translations': [{'text': item['Text'].upper()}]}
+                           for item in texts]).encode()
+        if self.malformed:
+            data = b'<html>Service Unavailable</html>'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class TranslateCase(AppTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubTranslator)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        class TranslateConfig(TestConfig):
+            MS_TRANSLATOR_KEY = 'key'
+            MS_TRANSLATOR_URL = f'http://127.0.0.1:{cls.server.server_port}'
+
+        cls.config = TranslateConfig
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubTranslator.fail = False
+        StubTranslator.malformed = False
+        StubTranslator.requests = []
+        super().setUp()
+        # unique per run, so entries left in Redis are never hit
+        self.text = f'hello {uuid.uuid4().hex}'
+
+    def test_translation_cache(self):
+        self.assertEqual(translate(self.text, 'en', 'es'), self.text.upper())
+        self.assertEqual(translate(self.text, 'en', 'es'), self.text.upper())
+        self.assertEqual(len(StubTranslator.requests), 1)
+        self.assertIn('from=en', StubTranslator.requests[0][0])
+        self.assertEqual(db.session.scalar(db.select(db.func.count(Translation.id))), 1)
+
+        # served from the database once the caches have lost it
+        cache.local_cache('translation').clear()
+        self.assertEqual(translate(self.text, 'en', 'es'), self.text.upper())
+        self.assertEqual(len(StubTranslator.requests), 1)
+
+        translate(self.text, 'en', 'fr')
+        self.assertEqual(len(StubTranslator.requests), 2)
+
+    def test_translate_batch(self):
+        translate(self.text, 'fr', 'en')
+        other = self.text + '!'
+        texts = {1: (self.text, 'es'), 2: (other, 'fr'), 3: (other, 'es'),
+                 4: (self.text, 'es'), 5: (self.text, 'fr')}
+        self.assertEqual(translate_batch(texts, 'en'), {
+            1: self.text.upper(), 2: other.upper(), 3: other.upper(),
+            4: self.text.upper(), 5: self.text.upper()})
+        # one request per source language, for the texts not seen before
+        self.assertEqual(sorted(texts for path, texts in StubTranslator.requests[1:]),
+                         [[self.text, other], [other]])
+
+    def test_translate_posts_language(self):
+        u = User(username='john', email='john@example.com')
+        p = Post(body=self.text, author=u, language='en')
+        db.session.add_all([u, p])
+        db.session.commit()
+        for language in ('es', 'xx', '<script>'):
+            with self.app.test_request_context(
+                    json={'dest_language': language, 'posts': [p.id]}):
+                login_user(u)
+                if language in self.app.config['LANGUAGES']:
+                    self.assertEqual(translate_posts().get_json(),
+                                     {'translations': {str(p.id): self.text.upper()}})
+                else:
+                    with self.assertRaises(BadRequest):
+                        translate_posts()
+        self.assertEqual(len(StubTranslator.requests), 1)
+
+    def test_failures_are_not_cached(self):
+        StubTranslator.fail = True
+        with self.app.test_request_context():
+            self.assertEqual(translate(self.text, 'en', 'es'),
+                             'Error: the translation service failed.')
+        StubTranslator.fail = False
+        self.assertEqual(translate(self.text, 'en', 'es'), self.text.upper())
+        self.assertEqual(len(StubTranslator.requests), 2)
+
+    def test_malformed_response(self):
+        StubTranslator.malformed = True
+        with self.app.test_request_context():
+            self.assertEqual(translate(self.text, 'en', 'es'),
+                             'Error: the translation service failed.')
+        StubTranslator.malformed = False
+        self.assertEqual(translate(self.text, 'en', 'es'), self.text.upper())
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -3,7 +3,7 @@ import pytest
 from datetime import datetime, timedelta
 from apps.user.models import User
 from apps.blog.models import Post
-from apps.db import db
+from apps.extensions import db
 
 def test_password_hashing():
     u = User(username="susan")
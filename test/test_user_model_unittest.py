@@ -1,23 +1,13 @@
 import unittest
 from datetime import datetime, timedelta
 
-from app import app
-from apps.db import db
+from config.settings import TestConfig
+from apps.extensions import db
 from apps.user.models import User
 from apps.blog.models import Post
+from test.base import AppTestCase
 
-class UserModelCase(unittest.TestCase):
-    def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
-        self.ctx = app.app_context()
-        self.ctx.push()
-        db.create_all()
-
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.ctx.pop()
-
+class UserModelCase(AppTestCase):
     def test_password_hashing(self):
         u = User(username='susan')
         u.set_password('cat')
@@ -85,5 +75,136 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_followed_posts_timeline(self):
+        u1 = User(username='john',  email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary',  email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        u1.follow(u2); u1.follow(u3)
+        db.session.commit()
+
+        now = datetime.utcnow()
+        p1 = Post(body="p1", author=u2, timestamp=now + timedelta(seconds=1))
+        p2 = Post(body="p2", author=u3, timestamp=now + timedelta(seconds=2))
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p2, p1])
+
+        u1.unfollow(u3)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p1])
+
+        # authors above the fan-out limit are pulled on read instead
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        try:
+            p3 = Post(body="p3", author=u2, timestamp=now + timedelta(seconds=3))
+            db.session.add(p3)
+            db.session.commit()
+            self.assertEqual(u1.followed_posts().all(), [p3, p1])
+            u1.rebuild_timeline()
+            db.session.commit()
+            self.assertEqual(u1.followed_posts().all(), [p3, p1])
+        finally:
+            self.app.config['TIMELINE_FANOUT_LIMIT'] = TestConfig.TIMELINE_FANOUT_LIMIT
+
+    def test_timeline_demotion(self):
+        author = User(username='john', email='john@example.com')
+        u1 = User(username='susan', email='susan@example.com')
+        u2 = User(username='mary', email='mary@example.com')
+        db.session.add_all([author, u1, u2])
+        db.session.commit()
+        u1.follow(author); u2.follow(author)
+        db.session.commit()
+
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        try:
+            # written while popular, so only pulled on read
+            p1 = Post(body="p1", author=author)
+            db.session.add(p1)
+            db.session.commit()
+            self.assertEqual(u2.followed_posts().all(), [p1])
+
+            # back under the limit, the remaining follower keeps the post
+            u1.unfollow(author)
+            db.session.commit()
+            self.assertFalse(author.is_popular())
+            self.assertEqual(u2.followed_posts().all(), [p1])
+
+            # the same when a recount finds the author was never popular
+            author.follower_count = 5
+            p2 = Post(body="p2", author=author, timestamp=p1.timestamp + timedelta(seconds=1))
+            db.session.add(p2)
+            db.session.commit()
+            User.recount()
+            db.session.commit()
+            self.assertEqual(u2.followed_posts().all(), [p2, p1])
+        finally:
+            self.app.config['TIMELINE_FANOUT_LIMIT'] = TestConfig.TIMELINE_FANOUT_LIMIT
+
+    def test_export_token(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        token = u.get_export_token('abc')
+        self.assertEqual(User.verify_export_token(token), (u.id, 'abc'))
+        self.assertIsNone(User.verify_export_token(token[:-1]))
+        self.assertIsNone(User.verify_export_token(u.get_reset_password_token()))
+
+    def test_counters(self):
+        u1 = User(username='john',  email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        u1.follow(u2)
+        p1 = Post(body="p1", author=u2)
+        p2 = Post(body="p2", author=u2)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.assertEqual((u1.followed_count, u1.follower_count), (1, 0))
+        self.assertEqual((u2.followed_count, u2.follower_count), (0, 1))
+        self.assertEqual(u2.post_count, 2)
+
+        db.session.delete(p1)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_count, 0)
+        self.assertEqual((u2.follower_count, u2.post_count), (0, 1))
+
+        u2.post_count = 42
+        db.session.commit()
+        User.recount()
+        db.session.commit()
+        self.assertEqual(u2.post_count, 1)
+
+    def test_counters_before_commit(self):
+        u1 = User(username='john',  email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary',  email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        # nothing queries in between: susan is popular by the second follow,
+        # so her posts are not backfilled
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        try:
+            u1.follow(u2)
+            u3.follow(u2)
+            self.assertTrue(u2.is_popular())
+            self.assertEqual((u2.follower_count, u3.followed_count), (2, 1))
+            with self.app.test_request_context():
+                self.assertEqual(u2.to_dict()['follower_count'], 2)
+
+            u1.unfollow(u2)
+            u3.unfollow(u2)
+            self.assertFalse(u2.is_popular())
+            self.assertEqual((u2.follower_count, u3.followed_count), (0, 0))
+            db.session.commit()
+            self.assertEqual(u2.follower_count, 0)
+        finally:
+            self.app.config['TIMELINE_FANOUT_LIMIT'] = TestConfig.TIMELINE_FANOUT_LIMIT
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)